@@ -0,0 +1,69 @@
+import asyncio
+import sys
+import time
+
+from aiohttp import web
+
+import edsm_limiter
+import elite
+
+#Times !ed info against a local fake EDSM that answers every request after a fixed delay,
+#comparing the lookups awaited one after another (like the old blocking code) with the concurrent fan-out.
+#Usage: python bench_info.py [latency ms] [rounds]
+
+responses = {
+    'system': {'name': 'Sol', 'information': {'government': 'Democracy', 'allegiance': 'Federation', 'population': 22780919531}, 'primaryStar': {'type': 'G (White-Yellow) Star', 'isScoopable': True}},
+    'bodies': {'bodies': [{'name': 'Earth', 'type': 'Planet', 'subType': 'Earth-like world'}]},
+    'stations': {'stations': [{'name': 'Abraham Lincoln', 'type': 'Orbis Starport', 'distanceToArrival': 498.4}, {'name': 'K7Q-BQL', 'type': 'Fleet Carrier', 'distanceToArrival': 12.1}]},
+    'traffic': {'traffic': {'total': 1000, 'week': 100, 'day': 10}},
+    'deaths': {'deaths': {'total': 50, 'week': 5, 'day': 1}},
+    'estimated-value': {'estimatedValue': 1000000, 'estimatedValueMapped': 3000000, 'valuableBodies': []},
+}
+
+def fake_edsm(latency):
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return web.json_response(responses.get(request.path.rsplit('/', 1)[-1], {}))
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handler)
+    return app
+
+async def info_sequential(systemName):
+    systemInfo = await elite.get_system_info_async(systemName)
+    bodiesInfo = await elite.get_bodies_in_system_async(systemName)
+    snapshot = await elite.get_station_snapshot_async(systemName)
+    trafficInfo = await elite.get_traffic_in_system_async(systemName)
+    deathInfo = await elite.get_deaths_in_system_async(systemName)
+    scanInfo = await elite.get_system_value_async(systemName)
+    return elite.format_system_info(systemName, systemInfo, bodiesInfo, snapshot.stations, snapshot.carriers, trafficInfo, deathInfo, scanInfo)
+
+async def time_rounds(label, info, rounds):
+    times = []
+    for i in range(rounds):
+        #a different system every round so nothing is answered from the caches
+        start = time.perf_counter()
+        await info('Sol {0} {1}'.format(label, i))
+        times.append(time.perf_counter() - start)
+    return sorted(times)
+
+async def main(latency, rounds):
+    runner = web.AppRunner(fake_edsm(latency))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    elite.edsmUrl = 'http://127.0.0.1:{0}/api-'.format(port)
+    elite.edsmLimiter = edsm_limiter.RateLimiter(rate=1000, burst=1000) #measure the lookups, not the rate limit
+    try:
+        print('{0} rounds with {1:.0f} ms per EDSM request'.format(rounds, latency * 1000))
+        for label, info in (('sequential', info_sequential), ('concurrent', elite.get_system_info_for_display_async)):
+            times = await time_rounds(label, info, rounds)
+            print('{0:>10}: median {1:.0f} ms, max {2:.0f} ms'.format(label, times[len(times) // 2] * 1000, times[-1] * 1000))
+    finally:
+        await elite.close_session()
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.2
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(latency, rounds))
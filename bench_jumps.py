@@ -0,0 +1,65 @@
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import elite
+import jump_analytics
+
+#Times the jump analytics on a synthetic flight log, against the per-entry strptime loop they replaced,
+#and checks the columns follow the same route as route_track.
+#Usage: python bench_jumps.py [jumps]
+
+def synthetic_log(jumps, seed=1):
+    '''A flight log of jumps entries, newest first like EDSM sends it, with the odd relog
+    (the same system again, sometimes in different case) and break between sessions. Returns it with the positions for it'''
+    rng = np.random.default_rng(seed)
+    gaps = np.where(rng.random(jumps) < 0.01, rng.uniform(7200, 50000, jumps), rng.uniform(30, 120, jumps))
+    start = datetime(2026, 1, 1)
+    logs = []
+    positions = []
+    xyz = np.cumsum(rng.normal(0, 20, (jumps, 3)), axis=0)
+    elapsed = np.cumsum(gaps)
+    for i in range(jumps):
+        name = 'System {0}'.format(i)
+        if i and rng.random() < 0.02: #relogged, the same system as the jump before
+            name = logs[-1]['system'].upper() if rng.random() < 0.5 else logs[-1]['system']
+        else:
+            positions.append({'name': name, 'coords': dict(zip('xyz', xyz[i].tolist()))})
+        logs.append({'system': name, 'date': (start + timedelta(seconds=float(elapsed[i]))).strftime('%Y-%m-%d %H:%M:%S')})
+    return {'logs': logs[::-1]}, positions
+
+def strptime_jump_rate(logs, threshold=7200):
+    '''The jump rate as it was worked out before the columns, one strptime per entry'''
+    lastDate = None
+    jumps = 0
+    totalTime = 0
+    for log in logs['logs']:
+        if lastDate:
+            timeDiff = (lastDate - datetime.strptime(log['date'], '%Y-%m-%d %H:%M:%S')).total_seconds()
+            if timeDiff < threshold:
+                jumps += 1
+                totalTime += timeDiff
+        lastDate = datetime.strptime(log['date'], '%Y-%m-%d %H:%M:%S')
+    return jumps / (totalTime / 3600.0)
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print('{0:>28}: {1:.3f}s'.format(label, time.perf_counter() - start))
+    return result
+
+if __name__ == '__main__':
+    jumps = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logs, positions = synthetic_log(jumps)
+    print('{0:,} log entries, {1:,} systems with coordinates'.format(jumps, len(positions)))
+    timed('strptime loop (rate only)', strptime_jump_rate, logs)
+    columns = timed('columns', jump_analytics.from_flight_log, logs, positions)
+    timed('all analytics on columns', elite.jump_stats, logs, positions)
+
+    track = list(elite.route_track(elite.extract_system_names_from_flight_log(logs)[::-1], positions))
+    assert list(columns.names) == [name for name, _ in track], 'columns and route_track disagree on the route'
+    known = np.array([coords is not None for _, coords in track])
+    assert np.array_equal(~np.isnan(columns.xyz[:, 0]), known), 'columns and route_track disagree on the coordinates'
+    print('{0:,} jumps after collapsing relogs, the same route as route_track'.format(len(columns)))
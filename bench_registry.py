@@ -0,0 +1,45 @@
+import sys
+import timeit
+
+from registry import PointOfInterest, Registry
+
+#Times commander and POI lookups in the Registry against the linear scans over plain dicts they replaced.
+#Usage: python bench_registry.py [commanders] [POIs]
+
+def scan_user_for_cmdr(cmdrNames, cmdr):
+    for user, cmd in cmdrNames.items():
+        if cmd == cmdr:
+            return user
+    return None
+
+def scan_POI(pointsOfInterest, name):
+    if (name in pointsOfInterest):
+        return pointsOfInterest[name]
+    nameLower = name.lower()
+    for n, poi in pointsOfInterest.items():
+        if nameLower == n.lower():
+            return poi
+    return None
+
+def per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+if __name__ == '__main__':
+    cmdrs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    pois = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    registry = Registry()
+    for i in range(cmdrs):
+        registry.set_cmdr('user{0}'.format(i), 'CMDR {0}'.format(i), 'key{0}'.format(i))
+    for i in range(pois):
+        registry.add_POI(PointOfInterest('Point {0}'.format(i), 'System {0}'.format(i), {'x': i, 'y': 0, 'z': 0}))
+    print('{0:,} commanders, {1:,} POIs'.format(cmdrs, pois))
+
+    #the last one added is the worst case for a scan
+    cmdr = 'CMDR {0}'.format(cmdrs - 1)
+    poi = 'point {0}'.format(pois - 1) #different case, so get_POI can't take the exact match shortcut
+    assert scan_user_for_cmdr(registry.cmdrNames, cmdr) == registry.get_user_for_cmdr(cmdr)
+    assert scan_POI(registry.pointsOfInterest, poi) is registry.get_POI(poi)
+    for label, scan, indexed in (
+            ('get_user_for_cmdr', lambda: scan_user_for_cmdr(registry.cmdrNames, cmdr), lambda: registry.get_user_for_cmdr(cmdr)),
+            ('get_POI, other case', lambda: scan_POI(registry.pointsOfInterest, poi), lambda: registry.get_POI(poi))):
+        print('{0:>20}: scan {1:.2f} ms, registry {2:.2f} us'.format(label, per_call(scan, 20) * 1e3, per_call(indexed, 100000) * 1e6))
@@ -0,0 +1,76 @@
+import io
+import sys
+import time
+
+import numpy as np
+from matplotlib.figure import Figure
+from PIL import Image
+
+import map_render
+from map_render import MapPlot
+
+#Times map_render.render on random walk routes against drawing every jump as one plain line plot, the way routes were drawn before decimation,
+#and reports how many pixels of the two images differ.
+#Usage: python bench_render.py [jumps, ...]
+
+def random_walk(jumps, seed=1):
+    '''A route of jumps steps around Sol in normalized (kly) coordinates, flatter in height like the galaxy'''
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.03, (jumps, 3))
+    steps[:, 1] *= 0.1
+    xyz = np.cumsum(steps, axis=0)
+    xyz[:, 2] -= 25
+    return xyz
+
+def draw_route_undecimated(plot, route, a0, a1, a2):
+    cmdr, color, xyz = route
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    if not plot.threeD:
+        a0.plot(x, z, 'o-', color=color, markersize=map_render.routeMarkerSize, zorder=2)
+        a1.plot(y, z, 'o-', color=color, markersize=map_render.routeMarkerSize, zorder=2)
+        a2.plot(x, y, 'o-', color=color, markersize=map_render.routeMarkerSize, zorder=2)
+        if plot.labels:
+            map_render.annotate(a0, cmdr, x[0], z[0])
+            map_render.annotate(a1, cmdr, y[0], z[0])
+            map_render.annotate(a2, cmdr, x[0], y[0])
+    else:
+        a0.plot(x, z, y, 'o-', color=color, markersize=map_render.routeMarkerSize, zorder=2)
+
+def render_undecimated(plot, dpi):
+    #laid out like map_render does it (the cached galaxy layer is drawn at the output dpi), so only the routes differ
+    fig = Figure() if plot.zoomed else Figure(dpi=dpi)
+    a0, a1, a2 = map_render.create_axes(fig, plot.threeD)
+    if plot.zoomed: map_render.zoom_to(plot, a0, a1, a2)
+    map_render.limit_and_label(a0, a1, a2, not plot.zoomed)
+    map_render.draw_systems(plot, a0, a1, a2)
+    for route in plot.routes:
+        draw_route_undecimated(plot, route, a0, a1, a2)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', facecolor='k', dpi=dpi)
+    return buffer.getvalue()
+
+def timed(func, *args):
+    start = time.perf_counter()
+    image = func(*args)
+    return image, time.perf_counter() - start
+
+def differing_pixels(a, b):
+    a = np.asarray(Image.open(io.BytesIO(a)).convert('RGB'), dtype=np.int16)
+    b = np.asarray(Image.open(io.BytesIO(b)).convert('RGB'), dtype=np.int16)
+    if a.shape != b.shape: return float('nan')
+    return np.mean(np.abs(a - b).max(axis=2) > 32) * 100
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+    dpi = 600
+    for jumps in sizes:
+        for zoomed in (False, True):
+            #no labels, the cached galaxy layer is laid out without them so they'd move the axes of the undecimated map
+            plot = MapPlot(threeD=False, zoomed=zoomed, labels=False)
+            plot.routes = [('CMDR Bench', None, random_walk(jumps))]
+            map_render.render(plot, dpi) #the full galaxy layer is drawn once per worker, don't count it
+            old, oldTime = timed(render_undecimated, plot, dpi)
+            new, newTime = timed(map_render.render, plot, dpi)
+            print('{0:>9,} jumps, {1:>11}: undecimated {2:.2f}s, decimated {3:.2f}s, {4:.2f}% of pixels differ'.format(
+                jumps, 'zoomed' if zoomed else 'full galaxy', oldTime, newTime, differing_pixels(old, new)))
@@ -0,0 +1,94 @@
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from spatial_index import SpatialIndex
+
+#Times SpatialIndex on synthetic systems spread like the galaxy's disc and checks every answer against a brute force scan.
+#Usage: python bench_spatial.py [systems] [queries]
+
+def synthetic_galaxy(count, seed=1):
+    rng = np.random.default_rng(seed)
+    radius = np.abs(rng.normal(0, 15000, count))
+    angle = rng.uniform(0, 2 * np.pi, count)
+    xyz = np.column_stack((radius * np.cos(angle), rng.normal(0, 300, count), radius * np.sin(angle) + 25000))
+    return ['Synthetic {0}'.format(i) for i in range(count)], xyz.astype(np.float32)
+
+def brute_force(xyz, coords, radius, minRadius=0):
+    dists = np.linalg.norm(xyz - np.array((coords['x'], coords['y'], coords['z']), dtype=np.float32), axis=1)
+    keep = np.flatnonzero((dists <= radius) & (dists >= minRadius))
+    return keep[np.argsort(dists[keep], kind='stable')], dists
+
+def check(label, results, expected, dists):
+    got = [int(r['name'].split()[-1]) for r in results]
+    #ties and float rounding can swap neighbours, so compare distances rather than the exact order
+    assert len(got) == len(expected), '{0}: {1} results, brute force found {2}'.format(label, len(got), len(expected))
+    assert np.allclose(np.sort(dists[got]), np.sort(dists[expected]), atol=1e-3), '{0}: results differ from brute force'.format(label)
+
+def timed(queries, func):
+    start = time.perf_counter()
+    results = [func(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+async def learn(index, learned, queries):
+    '''Adds learned systems on the event loop and merges them in a worker thread like the bot does,
+    measuring the longest the loop goes without running'''
+    longest = 0
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+    tick = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    due = False
+    for name, point in zip(*learned):
+        due = index.add('Learned {0}'.format(name), dict(zip('xyz', point.tolist()))) or due
+        await asyncio.sleep(0) #learned a few at a time between other work in the bot
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    if due: await asyncio.to_thread(index.merge_pending)
+    merged = time.perf_counter() - start
+    tick.cancel()
+    print('{0:,} learned systems added in {1:.2f}s, merged in a worker thread in {2:.2f}s, longest event loop stall {3:.0f} ms'.format(
+        len(learned[0]), added, merged, longest * 1000))
+    allXyz = index.grid[0]
+    for query in queries:
+        expected, dists = brute_force(allXyz, query, 50)
+        got = index.sphere(query, 50)
+        assert len(got) == len(expected), 'learned systems are missing after the merge'
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1200000
+    queryCount = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    names, xyz = synthetic_galaxy(count)
+    rng = np.random.default_rng(2)
+    #query around existing systems so the spheres aren't empty
+    queries = [dict(zip('xyz', (xyz[i] + rng.normal(0, 10, 3)).tolist())) for i in rng.integers(0, count, queryCount)]
+
+    start = time.perf_counter()
+    index = SpatialIndex()
+    index.add_many(names, xyz)
+    print('{0:,} systems indexed in {1:.2f}s'.format(count, time.perf_counter() - start))
+
+    for label, radius, minRadius in (('sphere 50 LY', 50, 0), ('shell 40-100 LY', 100, 40), ('sphere 10000 LY (clamped)', 10000, 0)):
+        results, ms = timed(queries, lambda q: index.sphere(q, radius, minRadius))
+        for query, result in zip(queries, results):
+            expected, dists = brute_force(xyz, query, min(radius, index.maxRadius), minRadius)
+            check(label, result, expected, dists)
+        print('{0:>26}: {1:.2f} ms per query, {2:.0f} systems on average, matches brute force'.format(label, ms, np.mean([len(r) for r in results])))
+
+    for label, k, queryList in (('10 nearest', 10, queries), ('10 nearest, empty space', 10, [{'x': 0, 'y': 5000, 'z': 0}])):
+        results, ms = timed(queryList, lambda q: index.nearest(q, k))
+        for query, result in zip(queryList, results):
+            expected, dists = brute_force(xyz, query, index.maxNearestRadius)
+            check(label, result, expected[:k], dists)
+        print('{0:>26}: {1:.2f} ms per query, matches brute force'.format(label, ms))
+
+    asyncio.run(learn(index, synthetic_galaxy(index.rebuildAt, seed=3), queries))
@@ -0,0 +1,65 @@
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import dump_import
+
+#Imports the fixture dump in one go, and again with a crash part way through followed by a resume,
+#and checks both give exactly the systems in the dump.
+#Usage: python check_dump_import.py [dump]
+
+class Interrupted(Exception):
+    pass
+
+def expected_systems(dumpPath):
+    opener = gzip.open if dumpPath.endswith('.gz') else open
+    with opener(dumpPath, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line.strip().rstrip(',')) for line in f if line.strip().startswith('{')]
+    records = [record for record in records if record.get('coords')]
+    return [record['name'] for record in records], np.array([[record['coords'][axis] for axis in 'xyz'] for record in records], dtype=np.float32)
+
+def check_arrays(label, directory, names, xyz):
+    arrays = dump_import.SystemArrays(directory)
+    assert [arrays[i] for i in range(len(arrays))] == names, '{0}: names differ from the dump'.format(label)
+    assert np.array_equal(np.asarray(arrays.xyz), xyz), '{0}: coordinates differ from the dump'.format(label)
+    print('{0}: {1} systems, names and coordinates match the dump'.format(label, len(arrays)))
+
+def import_interrupted(dumpPath, directory, checkpointEvery, failAt):
+    '''Crashes the import when it's about to save its failAt'th checkpoint, after that batch is already in the arrays'''
+    writeJson = dump_import._write_json
+    checkpoints = []
+    def failing_write_json(path, data):
+        if path.endswith(dump_import.PROGRESS):
+            checkpoints.append(data['records'])
+            if len(checkpoints) == failAt: raise Interrupted()
+        writeJson(path, data)
+    dump_import._write_json = failing_write_json
+    try:
+        dump_import.import_dump(dumpPath, directory, checkpointEvery)
+    except Interrupted:
+        pass
+    else:
+        raise AssertionError('the import finished before it could be interrupted')
+    finally:
+        dump_import._write_json = writeJson
+    assert not dump_import.is_imported(directory), 'an interrupted import was marked complete'
+
+if __name__ == '__main__':
+    dumpPath = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'systemsWithCoordinates.json.gz')
+    names, xyz = expected_systems(dumpPath)
+    directory = tempfile.mkdtemp()
+    try:
+        dump_import.import_dump(dumpPath, os.path.join(directory, 'whole'))
+        check_arrays('whole import', os.path.join(directory, 'whole'), names, xyz)
+
+        resumed = os.path.join(directory, 'resumed')
+        import_interrupted(dumpPath, resumed, checkpointEvery=3, failAt=2)
+        dump_import.import_dump(dumpPath, resumed, checkpointEvery=3)
+        check_arrays('interrupted and resumed', resumed, names, xyz)
+    finally:
+        shutil.rmtree(directory)
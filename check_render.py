@@ -0,0 +1,48 @@
+import io
+import sys
+
+import numpy as np
+from matplotlib.figure import Figure
+
+import map_render
+from bench_render import differing_pixels, random_walk
+from map_render import MapPlot
+
+#Checks full galaxy maps drawn over the cached GalaxyLayer against the same map drawn on a fresh figure, in 2D and 3D.
+#Usage: python check_render.py [jumps] [dpi]
+
+def render_fresh(plot, dpi):
+    '''The full galaxy map drawn the way zoomed maps are, with its own figure and a full draw'''
+    fig = Figure(dpi=dpi)
+    a0, a1, a2 = map_render.create_axes(fig, plot.threeD)
+    map_render.limit_and_label(a0, a1, a2, True)
+    fig.tight_layout() #before the routes, like the layer, so they're decimated for the same axes size
+    map_render.draw_systems(plot, a0, a1, a2)
+    for route in plot.routes:
+        map_render.draw_route(plot, route, a0, a1, a2, dpi)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', facecolor='k', dpi=dpi)
+    return buffer.getvalue()
+
+def long_jumps(jumps, seed=2):
+    '''A route of jumps of a few kly each around the middle of the galaxy, normalized like random_walk'''
+    rng = np.random.default_rng(seed)
+    return rng.uniform((-20, -2, -10), (20, 2, 30), (jumps, 3))
+
+if __name__ == '__main__':
+    jumps = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    for threeD in (False, True):
+        #no labels, the cached galaxy layer is laid out without them so they'd move the axes of the fresh figure
+        plot = MapPlot(threeD=threeD, labels=False)
+        plot.systems = [('Sol', 0, 0, 0), ('Sagittarius A*', 25.21875, -0.02, 25.89999)]
+        #a long dense route, and a short one of long jumps so its lines show between the markers
+        plot.routes = [('CMDR One', None, random_walk(jumps)), ('CMDR Two', 'r', long_jumps(100))]
+        fresh = render_fresh(plot, dpi)
+        for attempt in ('first', 'reused'):
+            #the second map on the layer checks the first one's artists were cleaned up
+            differ = differing_pixels(fresh, map_render.render(plot, dpi))
+            print('{0}, {1} layer: {2:.3f}% of pixels differ from a fresh figure'.format('3D' if threeD else '2D', attempt, differ))
+            assert differ < 0.01, 'the map drawn over the cached layer differs from a fresh figure'
+        empty = differing_pixels(fresh, map_render.render(MapPlot(threeD=threeD), dpi))
+        assert empty > 0.01, 'the routes are missing from the fresh figure, nothing was compared'
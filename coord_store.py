@@ -0,0 +1,182 @@
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+def normalize_name(name):
+    return name.strip().casefold()
+
+class CoordinateStore:
+    '''System coordinates keyed by normalized system name, persisted in SQLite.
+    Coordinates never change so entries are never expired.
+    Once start is called, new coordinates are queued and written in the background every interval seconds
+    (or as soon as batchSize are waiting), reads see them straight away. Until then they're written straight through'''
+    def __init__(self, path, interval=2.0, batchSize=1000):
+        self.path = path
+        self.interval = interval
+        self.batchSize = batchSize
+        self._db = None
+        self._lock = threading.Lock()
+        self._pending = {} #key -> row waiting to be written
+        self._pendingLock = threading.Lock()
+        self._flushLock = threading.Lock() #keeps batches reaching the database in order
+        self._task = None
+        self._wake = None
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory: os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL') #durable enough with WAL, commits don't wait on fsync
+            self._db.execute('CREATE TABLE IF NOT EXISTS systems (key TEXT PRIMARY KEY, name TEXT, x REAL, y REAL, z REAL)')
+        return self._db
+
+    def get(self, name):
+        '''Returns the coordinates of the system or None if it isn't stored'''
+        key = normalize_name(name)
+        with self._pendingLock:
+            row = self._pending.get(key)
+        if row: return {'x': row[2], 'y': row[3], 'z': row[4]}
+        with self._lock:
+            row = self._connect().execute('SELECT x, y, z FROM systems WHERE key = ?', (key,)).fetchone()
+        if not row: return None
+        return {'x': row[0], 'y': row[1], 'z': row[2]}
+
+    def get_many(self, names):
+        '''Returns a dict of name to coordinates for each of the names that are stored'''
+        found = {}
+        keys = {}
+        for name in names:
+            keys.setdefault(normalize_name(name), []).append(name)
+        with self._pendingLock:
+            for key in keys:
+                row = self._pending.get(key)
+                if row:
+                    for name in keys[key]:
+                        found[name] = {'x': row[2], 'y': row[3], 'z': row[4]}
+        keyList = [key for key in keys if keys[key][0] not in found]
+        with self._lock:
+            db = self._connect()
+            for i in range(0, len(keyList), 500): #stay under sqlite's variable limit
+                chunk = keyList[i:i+500]
+                query = 'SELECT key, x, y, z FROM systems WHERE key IN ({0})'.format(','.join('?'*len(chunk)))
+                for key, x, y, z in db.execute(query, chunk):
+                    for name in keys[key]:
+                        found[name] = {'x': x, 'y': y, 'z': z}
+        return found
+
+    def put(self, name, coords):
+        self.put_many([(name, coords)])
+
+    def put_many(self, systems):
+        '''Stores an iterable of (name, coords) pairs, in a single transaction or queued for the background writer'''
+        rows = [(normalize_name(name), name, float(c['x']), float(c['y']), float(c['z'])) for name, c in systems]
+        if not rows: return
+        if self._task is None:
+            self._write(rows)
+            return
+        with self._pendingLock:
+            for row in rows:
+                self._pending[row[0]] = row
+            full = len(self._pending) >= self.batchSize
+        if full: self._wake.set()
+
+    def _write(self, rows):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany('INSERT OR REPLACE INTO systems VALUES (?, ?, ?, ?, ?)', rows)
+
+    def flush(self):
+        '''Writes the queued coordinates. If that fails they're queued again, behind anything newer'''
+        with self._flushLock:
+            with self._pendingLock:
+                rows = self._pending
+                if not rows: return
+                self._pending = {}
+            try:
+                self._write(list(rows.values()))
+            except Exception:
+                with self._pendingLock:
+                    for key, row in rows.items(): self._pending.setdefault(key, row)
+                raise
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        '''Stops the background writer and writes out anything still queued'''
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print('Could not store coordinates: {0!r}'.format(e))
+
+    def iter_arrays(self, batchSize=100000):
+        '''Yields every stored system, batchSize at a time, as a list of names and an (n, 3) float32 array of their coordinates'''
+        self.flush()
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._connect().execute('SELECT rowid, name, x, y, z FROM systems WHERE rowid > ? ORDER BY rowid LIMIT ?', (last, batchSize)).fetchall()
+            if not rows: return
+            rowids, names, x, y, z = zip(*rows)
+            last = rowids[-1]
+            yield list(names), np.column_stack((x, y, z)).astype(np.float32)
+
+    def preload(self, dumpPath, batchSize=10000):
+        '''Bulk loads an EDSM systemsWithCoordinates dump (optionally gzipped), one record per line'''
+        opener = gzip.open if dumpPath.endswith('.gz') else open
+        count = 0
+        batch = []
+        with opener(dumpPath, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip().rstrip(',')
+                if not line.startswith('{'): continue #the enclosing [ and ]
+                record = json.loads(line)
+                if 'coords' not in record: continue
+                batch.append((record['name'], record['coords']))
+                if len(batch) >= batchSize:
+                    self.put_many(batch)
+                    count += len(batch)
+                    batch = []
+        self.put_many(batch)
+        count += len(batch)
+        print('Preloaded coordinates for {0} systems from {1}'.format(count, dumpPath))
+        return count
+
+    def __len__(self):
+        self.flush()
+        with self._lock:
+            return self._connect().execute('SELECT COUNT(*) FROM systems').fetchone()[0]
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python coord_store.py <systemsWithCoordinates.json[.gz]> [store path]')
+        sys.exit(1)
+    store = CoordinateStore(sys.argv[2] if len(sys.argv) > 2 else 'data/coords.db')
+    store.preload(sys.argv[1])
@@ -1,6 +1,8 @@
+import asyncio
 import discord
 from discord.ext import commands
 import re
+import signal
 import traceback
 import math
 
@@ -10,6 +12,10 @@ import elite_mapper
 description = '''Elite: Dangerous connector bot.'''
 
 token = ''
+pollPositions = True #keep registered commanders' positions fresh in the background
+#run in the background after login so the first commands don't start cold, () to skip.
+#'indexes' builds the spatial index for !ed nearest, and for !ed radius once a dump is imported
+warmUpStages = ('coordinates', 'indexes', 'flightLogs')
 uid_regex = re.compile(r'<.*?(\d+)>')
 
 intents = discord.Intents.default()
@@ -23,20 +29,24 @@ async def on_ready():
     print(bot.user.id)
     print('------')
     elite.load_data()
+    elite.start_data_writer()
+    if pollPositions:
+        elite.start_position_poller()
+    elite.start_warm_up(warmUpStages)
 
 @bot.command(name='locate')
 async def locate(ctx: commands.Context, name = None):
     """Gets the location of a commander (alt for 'location')"""
-    await ctx.send(locate_handler(ctx, name))
+    await ctx.send(await locate_handler(ctx, name))
 
 @bot.command(name='location')
 async def location(ctx: commands.Context, name = None):
     """Gets the location of a commander (alt for 'locate')"""
-    await ctx.send(locate_handler(ctx, name))
+    await ctx.send(await locate_handler(ctx, name))
 
-def locate_handler(ctx: commands.Context, name):
+async def locate_handler(ctx: commands.Context, name):
     cmdr = get_uid(name or str(ctx.message.author.id))
-    loc = elite.get_cmdr_system_name(cmdr)
+    loc = await elite.get_cmdr_system_name_async(cmdr)
     cmdrName, _ = elite.get_cmdr(cmdr)
     if not loc or loc == 'None':
         return '{0} could not be located'.format(name)
@@ -68,7 +78,7 @@ async def poi(ctx: commands.Context, poiName: str, poiLocation = None):
             else:
                 msg = '"{0}" is not a known point of interest'.format(poiName)
         else:
-            poi = elite.add_POI(poiName, poiLocation)
+            poi = await elite.add_POI_async(poiName, poiLocation)
             if poi:
                 msg = 'Added Point of Interest "{0}" at {1} {2}'.format(poi.name, poi.system, poi.coords)
             else:
@@ -95,7 +105,7 @@ async def distance(ctx: commands.Context, item1: str, item2: str):
     """Gets the distance between two items (CMDR, PoI, System)"""
     uid1 = get_uid(item1)
     uid2 = get_uid(item2)
-    dist = elite.friendly_get_distance(uid1, uid2)
+    dist = await elite.friendly_get_distance_async(uid1, uid2)
     dist = round(dist, 2)
     msg = '{0} is {1} LY from {2}'.format(item2, dist, item1)
     await ctx.send(msg)
@@ -104,23 +114,26 @@ async def distance(ctx: commands.Context, item1: str, item2: str):
 async def info(ctx: commands.Context, system: str):
     """Gets detailed information on a system (alt for 'system')"""
     await ctx.typing()
-    await ctx.send(info_handler(system))
+    await ctx.send(await info_handler(system))
     
 @bot.command(name='system', pass_context=True)
 async def system(ctx: commands.Context, system: str):
     """Gets detailed information on a system (alt for 'info')"""
     await ctx.typing()
-    await ctx.send(info_handler(system))
+    await ctx.send(await info_handler(system))
 
-def info_handler(system):
-    return elite.get_system_info_for_display(system)
+async def info_handler(system):
+    return await elite.get_system_info_for_display_async(system)
 
 @bot.command(name='radius', pass_context=True)
 async def radius(ctx: commands.Context, system: str, radius: float, minRadius = 0.0):
     """Returns systems within a radius around a system"""
     await ctx.typing()
-    coords = elite.friendly_get_coords(system)
-    systems = elite.get_systems_in_radius(coords, radius, minRadius)
+    coords = await elite.friendly_get_coords_async(system)
+    if not coords:
+        await ctx.send('Could not find "{0}"'.format(system))
+        return
+    systems = await elite.get_systems_in_radius_async(coords, radius, minRadius)
     if systems:
         msg = '{0} systems between {1} and {2} LY from {3}'.format(len(systems), minRadius, radius, system)
         if len(systems) > 0:
@@ -139,12 +152,30 @@ async def radius(ctx: commands.Context, system: str, radius: float, minRadius =
         msg = 'No systems in range'
     await ctx.send(msg)
 
+@bot.command(name='nearest', pass_context=True)
+async def nearest(ctx: commands.Context, system: str, count: int = 10):
+    """Lists the closest known systems to a system, CMDR or PoI"""
+    coords = await elite.friendly_get_coords_async(system)
+    if not coords:
+        await ctx.send('Could not find "{0}"'.format(system))
+        return
+    systems = await elite.get_nearest_systems_async(coords, min(count, 50))
+    if systems is None:
+        msg = 'The system index is still being built, try again shortly'
+    elif systems:
+        msg = 'Closest known systems to {0}:\n'.format(system)
+        for sys in systems:
+            msg += '{0}: {1} LY\n'.format(sys['name'], sys['distance'])
+    else:
+        msg = 'No known systems near {0}'.format(system)
+    await ctx.send(msg)
+
 @bot.command(name='balance', pass_context=True)
 async def balance(ctx: commands.Context, name = None):
     '''Gets credit balance of cmdr name'''
     await ctx.typing()
     cmdr = get_uid(name or str(ctx.message.author.id))
-    credits = elite.get_credits(cmdr)
+    credits = await elite.get_credits_async(cmdr)
     msg = '{0} '.format(name)
     if credits and credits['msgnum'] == 100:
         msg += 'has {:,} credits.'.format(credits['credits'][0]['balance'])
@@ -158,7 +189,7 @@ async def ranks(ctx: commands.Context, name = None):
     await ctx.typing()
     name = get_uid(name or str(ctx.message.author.id))
     cmdr, _ = elite.get_cmdr(name)
-    ranks = elite.get_ranks(cmdr)
+    ranks = await elite.get_ranks_async(cmdr)
     msg = '__{0}__\n'.format(cmdr)
     display_format = '{0} : {1} ({2}%)\n'
     if ranks and ranks['msgnum'] == 100:
@@ -179,7 +210,7 @@ async def materials(ctx: commands.Context, name = None):
     '''Gets all materials for the cmdr'''
     await ctx.typing()
     cmdr = get_uid(name or str(ctx.message.author.id))
-    materials = elite.get_materials(cmdr)
+    materials = await elite.get_materials_async(cmdr)
     msg = '_{0} materials_\n'.format(name)
     if materials and materials['msgnum'] == 100:
         for mats in materials['materials']:
@@ -195,7 +226,7 @@ async def cargo(ctx: commands.Context, name = None):
     '''Gets all cargo for the cmdr'''
     await ctx.typing()
     cmdr = get_uid(name or str(ctx.message.author.id))
-    cargo = elite.get_cargo(cmdr)
+    cargo = await elite.get_cargo_async(cmdr)
     msg = '_{0} cargo_\n'.format(name)
     cargoNum = 0
     if cargo and cargo['msgnum'] == 100:
@@ -218,7 +249,7 @@ async def data(ctx: commands.Context, name = None):
     '''Gets all encoded data for the cmdr'''
     await ctx.typing()
     cmdr = get_uid(name or str(ctx.message.author.id))
-    encodedData = elite.get_encoded_data(cmdr)
+    encodedData = await elite.get_encoded_data_async(cmdr)
     msg = '_{0} encoded data_\n'.format(name)
     if encodedData and encodedData['msgnum'] == 100:
         for data in encodedData['data']:
@@ -233,9 +264,11 @@ async def data(ctx: commands.Context, name = None):
 async def map(ctx):
 	'''Returns a map of the requested items'''
 	await ctx.typing()
-	elite_mapper.parse_and_plot(ctx.message.content)
-	with open('data/fig.png', 'rb') as f:
-		await ctx.send(file=discord.File(f, 'fig.png'))
+	image = await elite_mapper.parse_and_plot(ctx.message.content)
+	if not image:
+		await ctx.send('Too many maps are being drawn right now, try again in a moment.')
+		return
+	await ctx.send(file=discord.File(image, 'map.' + elite_mapper.mapFormat))
 	
 @bot.command(name='rate')
 async def rate(ctx: commands.Context, name = None):
@@ -243,9 +276,10 @@ async def rate(ctx: commands.Context, name = None):
     name = get_uid(name or str(ctx.message.author.id))
     try:
         cmdr, _ = elite.get_cmdr(name)
-        rate = elite.get_jump_rate(cmdr)
-        dist = elite.get_average_jump_distance(cmdr)
-        distRate = rate*dist
+        stats = await elite.get_jump_stats_async(cmdr)
+        rate = stats['rate']
+        dist = stats['distance']
+        distRate = stats['distancePerHour']
         msg = f'{cmdr} jumps {rate:0.2f} times per hour at an average jump distance of {dist:0.2f} ly for a rate of {distRate:0.2f} ly per hour.'
     except:
         msg = f'Could not determine rate information for "{name}": {traceback.format_exc().splitlines()[-1]}'
@@ -258,9 +292,10 @@ async def target(ctx: commands.Context, system: str, name = None):
     try:
         cmdr, known = elite.get_cmdr(name)
         if not known: return 'Command requires target system and commander name!'
-        rate = elite.get_jump_rate(cmdr)
-        avgDist = elite.get_average_jump_distance(cmdr)
-        dist = elite.friendly_get_distance(cmdr, system)
+        stats = await elite.get_jump_stats_async(cmdr)
+        rate = stats['rate']
+        avgDist = stats['distance']
+        dist = await elite.friendly_get_distance_async(cmdr, system)
         jumps = math.ceil(dist/avgDist)
         time = jumps / rate
         msg = f'"{system}" is {dist:0.2f} ly from {cmdr}. That\'s about {jumps} jumps or {time:0.2f} hours.'
@@ -272,4 +307,21 @@ def get_token():
     with open('data/token.secret', 'r') as f:
         return f.readline().strip()
 
-bot.run(get_token())
+async def main():
+    try:
+        #docker stop sends SIGTERM (python runs as PID 1, so there's no default handler), close the bot so the cleanup below still runs
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+    except NotImplementedError: #no signal handlers on Windows event loops
+        pass
+    try:
+        async with bot:
+            await bot.start(get_token())
+    finally:
+        await elite.stop_warm_up()
+        await elite.stop_position_poller()
+        await elite.stop_data_writer()
+        await elite.close_session()
+        elite_mapper.shutdown()
+
+if __name__ == '__main__': #map workers are spawned processes that import this module, they mustn't start the bot
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+#files written to the output directory
+NAMES = 'names.bin' #utf-8 system names back to back
+OFFSETS = 'offsets.bin' #uint64 end offset of each name in names.bin
+XYZ = 'xyz.bin' #float32 x, y, z for each system
+PROGRESS = 'progress.json' #checkpoint while an import is running
+META = 'meta.json' #written once an import completes
+
+class SystemArrays:
+    '''Memory-mapped view of an imported dump. Indexing returns system names, xyz is an (n, 3) array'''
+    def __init__(self, directory):
+        with open(os.path.join(directory, META)) as f:
+            self.meta = json.load(f)
+        count = self.meta['records']
+        self.names = np.memmap(os.path.join(directory, NAMES), dtype=np.uint8, mode='r') if self.meta['namesBytes'] else np.empty(0, np.uint8)
+        self.offsets = np.memmap(os.path.join(directory, OFFSETS), dtype=np.uint64, mode='r', shape=(count,)) if count else np.empty(0, np.uint64)
+        self.xyz = np.memmap(os.path.join(directory, XYZ), dtype=np.float32, mode='r', shape=(count, 3)) if count else np.empty((0, 3), np.float32)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        start = int(self.offsets[i - 1]) if i > 0 else 0
+        return bytes(self.names[start:int(self.offsets[i])]).decode('utf-8')
+
+def is_imported(directory):
+    return os.path.exists(os.path.join(directory, META))
+
+def _write_json(path, data):
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+def _truncate(path, size):
+    with open(path, 'ab') as f:
+        f.truncate(size)
+
+def import_dump(dumpPath, directory, checkpointEvery=100000):
+    '''Streams an EDSM systemsWithCoordinates dump (json, optionally gzipped) into binary arrays in directory.
+    Memory use is bounded by checkpointEvery records. An interrupted import picks up from its last checkpoint'''
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, name) for name in (NAMES, OFFSETS, XYZ)}
+    progressPath = os.path.join(directory, PROGRESS)
+    progress = {'source': os.path.abspath(dumpPath), 'inputOffset': 0, 'records': 0, 'namesBytes': 0}
+    if os.path.exists(progressPath):
+        with open(progressPath) as f:
+            saved = json.load(f)
+        if saved.get('source') == progress['source']:
+            progress = saved
+            print('Resuming import of {0} at record {1}'.format(dumpPath, progress['records']))
+    #throw away anything written after the last checkpoint
+    _truncate(paths[NAMES], progress['namesBytes'])
+    _truncate(paths[OFFSETS], progress['records'] * 8)
+    _truncate(paths[XYZ], progress['records'] * 12)
+    if os.path.exists(os.path.join(directory, META)): os.remove(os.path.join(directory, META))
+
+    totalSize = os.path.getsize(dumpPath)
+    opener = gzip.open if dumpPath.endswith('.gz') else open
+    start = time.monotonic()
+    startRecords = progress['records']
+    names = bytearray()
+    offsets = []
+    xyz = []
+
+    def checkpoint(raw, offset):
+        progress['inputOffset'] = offset
+        with open(paths[NAMES], 'ab') as f: f.write(names)
+        with open(paths[OFFSETS], 'ab') as f: np.array(offsets, dtype=np.uint64).tofile(f)
+        with open(paths[XYZ], 'ab') as f: np.array(xyz, dtype=np.float32).reshape(-1, 3).tofile(f)
+        progress['records'] += len(offsets)
+        progress['namesBytes'] += len(names)
+        names.clear()
+        offsets.clear()
+        xyz.clear()
+        _write_json(progressPath, progress)
+        elapsed = time.monotonic() - start
+        #position in the compressed file, for a percentage of the whole dump
+        read = raw.tell() if raw else offset
+        print('Imported {0:,} systems ({1:.1f}%), {2:,.0f} systems/s'.format(
+            progress['records'], 100.0 * read / totalSize if totalSize else 100,
+            (progress['records'] - startRecords) / elapsed if elapsed > 0 else 0))
+
+    with opener(dumpPath, 'rb') as f:
+        raw = getattr(f, 'fileobj', None)
+        offset = progress['inputOffset']
+        if offset: f.seek(offset) #gzip seeks by decompressing forward, still bounded memory
+        for line in f:
+            offset += len(line)
+            line = line.strip().rstrip(b',')
+            if not line.startswith(b'{'): continue #the enclosing [ and ]
+            record = json.loads(line)
+            coords = record.get('coords')
+            if not coords: continue
+            names.extend(record['name'].encode('utf-8'))
+            offsets.append(progress['namesBytes'] + len(names))
+            xyz.append((coords['x'], coords['y'], coords['z']))
+            if len(offsets) >= checkpointEvery:
+                checkpoint(raw, offset)
+        checkpoint(raw, offset)
+
+    _write_json(os.path.join(directory, META), {'source': progress['source'], 'records': progress['records'], 'namesBytes': progress['namesBytes']})
+    os.remove(progressPath)
+    print('Finished importing {0:,} systems in {1:.1f}s'.format(progress['records'], time.monotonic() - start))
+    return progress['records']
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python dump_import.py <systemsWithCoordinates.json[.gz]> [output directory]')
+        sys.exit(1)
+    import_dump(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'data/systems')
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    '''LRU cache of EDSM responses where each entry expires based on the endpoint it came from.
+    ttls maps (api, endpoint) to seconds, None meaning the data never goes stale'''
+    def __init__(self, ttls, maxEntries=4096, defaultTTL=0, emptyTTL=300):
+        self.ttls = ttls
+        self.maxEntries = maxEntries
+        self.defaultTTL = defaultTTL
+        self.emptyTTL = emptyTTL #empty results are usually unknown names, which can show up later
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(api, endpoint, params):
+        items = []
+        for p, v in sorted((params or {}).items()):
+            items.append((p, tuple(str(val) for val in v) if isinstance(v, list) else str(v)))
+        return (api or '', endpoint, tuple(items))
+
+    def ttl_for(self, api, endpoint):
+        return self.ttls.get((api or '', endpoint), self.defaultTTL)
+
+    def get(self, key):
+        '''Returns the cached response or None if it's missing or expired'''
+        entry = self.entries.get(key)
+        if entry:
+            expires, response = entry
+            if expires is None or expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, response):
+        if response is None: return
+        ttl = self.ttl_for(key[0], key[1])
+        if not response and (ttl is None or ttl > self.emptyTTL):
+            ttl = self.emptyTTL
+        if ttl is not None and ttl <= 0: return
+        expires = None if ttl is None else time.monotonic() + ttl
+        self.entries[key] = (expires, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / total if total else 0
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import random
+import time
+
+#lanes, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+lane = contextvars.ContextVar('edsmLane', default=INTERACTIVE)
+
+@contextlib.contextmanager
+def background():
+    '''EDSM requests made inside this block (and tasks started from it) wait behind interactive ones'''
+    token = lane.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        lane.reset(token)
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    '''Full jitter exponential backoff'''
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def retry_after(headers):
+    '''Seconds from a Retry-After header, 0 if it's missing or an HTTP date'''
+    try:
+        return float(headers.get('Retry-After', 0))
+    except ValueError:
+        return 0
+
+class RateLimiter:
+    '''Token bucket shared by every EDSM request in the process.
+    Waiting requests are let through in lane order, then in the order they arrived'''
+    def __init__(self, rate, burst, minRate=0.05):
+        self.rate = rate #tokens per second
+        self.maxRate = rate
+        self.minRate = minRate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.pausedUntil = 0
+        self._queue = [] #[priority, arrival, waiter], lists so a waiting request can be promoted in place
+        self._waiting = {} #task -> its entry in the queue
+        self._promoted = {} #task -> lane it was promoted to, for its retries too
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority=None):
+        if priority is None: priority = lane.get()
+        task = asyncio.current_task()
+        priority = min(priority, self._promoted.get(task, priority))
+        waiter = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), waiter]
+        heapq.heappush(self._queue, entry)
+        self._waiting[task] = entry
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await waiter
+        finally:
+            self._waiting.pop(task, None)
+
+    def promote(self, task, priority=INTERACTIVE):
+        '''Moves task's requests up to the priority lane, the one waiting now and any it makes later.
+        For when a caller in a higher lane starts waiting on a request another task is making'''
+        if self._promoted.get(task, priority + 1) <= priority: return
+        if task not in self._promoted:
+            task.add_done_callback(lambda t: self._promoted.pop(t, None))
+        self._promoted[task] = priority
+        entry = self._waiting.get(task)
+        if entry and entry[0] > priority:
+            entry[0] = priority
+            heapq.heapify(self._queue)
+
+    def acquire_blocking(self):
+        '''Waits for a token by sleeping, for synchronous callers. They're let through as soon as a token is free,
+        without waiting behind the async queue, since that can't drain while the event loop's thread is blocked'''
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self.pausedUntil - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    async def _dispatch(self):
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.done(): #caller gave up
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            self._refill(now)
+            wait = self.pausedUntil - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    heapq.heappop(self._queue)
+                    self.tokens -= 1
+                    waiter.set_result(None)
+                    continue
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        '''Stops handing out tokens for a while, ie after being throttled'''
+        self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        '''Slows down to what's left of EDSM's X-Rate-Limit allowance'''
+        try:
+            remaining = int(headers['X-Rate-Limit-Remaining'])
+            reset = float(headers['X-Rate-Limit-Reset'])
+        except (KeyError, ValueError):
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, remaining)
+        if remaining <= 0:
+            self.pause(reset)
+        elif reset > 0:
+            #spread what's left over the time until the allowance resets
+            self.rate = max(self.minRate, min(self.maxRate, remaining / reset))
+        else:
+            self.rate = self.maxRate
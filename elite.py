@@ -1,24 +1,94 @@
 import math
 import operator
+import aiohttp
+import asyncio
+import contextvars
 import requests
-from datetime import datetime
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone
 
-apiKeys = {}
-cmdrNames = {}
-pointsOfInterest = {}
+from coord_store import CoordinateStore
+from edsm_cache import ResponseCache
+import edsm_limiter
+from flight_log_cache import FlightLogCache
+import dump_import
+import jump_analytics
+import name_resolver
+from name_resolver import Resolution, ResolutionCache
+from position_poller import PositionPoller
+from registry import PointOfInterest, Registry
+from spatial_index import SpatialIndex
+import storage
 
-flightLogCache = {}
+registry = Registry()
+#the registry's own dicts, read only. Changes go through the functions below so its indexes stay in step
+apiKeys = registry.apiKeys
+cmdrNames = registry.cmdrNames
+pointsOfInterest = registry.pointsOfInterest
+
+stationSnapshots = {}
 
 debug = False
 
-class PointOfInterest:
-    def __init__(self, Name, SystemName, Coords):
-        self.name = Name
-        self.system = SystemName
-        self.coords = Coords
-        self.coords['x'] = float(self.coords['x'])
-        self.coords['y'] = float(self.coords['y'])
-        self.coords['z'] = float(self.coords['z'])
+edsmUrl = 'https://www.edsm.net/api-'
+edsmTimeout = 30 #seconds
+maxConnections = 20
+subRequestTimeout = 10 #seconds, for each lookup in a concurrent fan-out
+coordinateParallelism = 4 #concurrent 'systems' requests when resolving lots of coordinates
+edsmRetries = 4 #extra attempts after being throttled (429) or an EDSM server error
+stationSnapshotTTL = 60 #seconds
+
+#how long each EDSM endpoint's responses stay fresh, in seconds. None never expires
+edsmCacheTTLs = {
+    ('', 'system'): 24*3600, #coords never change, information is slow moving
+    ('', 'systems'): None, #only ever asked for coordinates
+    ('', 'sphere-systems'): 3600,
+    ('system', 'bodies'): 3600,
+    ('system', 'estimated-value'): 3600,
+    ('system', 'stations'): 600,
+    ('system', 'traffic'): 300,
+    ('system', 'deaths'): 300,
+    ('logs', 'get-position'): 15,
+    ('logs', 'get-logs'): 60,
+    ('commander', 'get-credits'): 60,
+    ('commander', 'get-ranks'): 300,
+    ('commander', 'get-materials'): 60
+}
+edsmCache = ResponseCache(edsmCacheTTLs, maxEntries=4096)
+nameCache = ResolutionCache(systemTTL=3600, cmdrTTL=30, negativeTTL=300) #what names given to commands turned out to be
+edsmLimiter = edsm_limiter.RateLimiter(rate=2, burst=10) #requests per second across the whole bot
+coordStore = CoordinateStore('data/coords.db')
+#where commanders, api keys and POIs live. storage.CsvStorage('data') keeps the old csv files instead.
+#Changes are queued and written in the background by start_data_writer, so commands never wait on the disk
+dataStore = storage.WriteBehind(storage.SqliteStorage('data/ed_data.db', csvDirectory='data'), interval=2, batchSize=50)
+flightLogCache = FlightLogCache('data/flight_logs.db', maxEntries=500, maxAge=7*24*3600)
+incrementalFlightLogs = True #only fetch log entries newer than what's cached and merge them in
+flightLogHistoryDays = 30 #how much merged history to keep for jump analytics
+spatialIndex = None #built by build_spatial_index
+systemDumpDirectory = 'data/systems' #arrays written by dump_import.py, indexed instead of the coordinate store when present
+localRadiusQueries = False #answer radius queries from spatialIndex even when it wasn't built from a full dump
+
+_session = None
+positionPoller = None #started with start_position_poller, commands then answer positions from its snapshot
+warmUpTask = None #started with start_warm_up
+indexMergeTask = None #merging systems learned from EDSM into spatialIndex in a worker thread
+_inFlight = {} #cache key -> task for EDSM requests that are currently running
+requestCounters = {'network': 0, 'coalesced': 0}
+requestTimeout = contextvars.ContextVar('edsmRequestTimeout', default=None) #seconds per EDSM request once it's through the rate limiter, set by gather_lookups
+
+class StationSnapshot:
+    '''All stations in a system, split into fleet carriers and everything else in one pass'''
+    def __init__(self, stations):
+        self.fetched = time.monotonic()
+        self.all = stations
+        self.stations = []
+        self.carriers = []
+        for station in stations:
+            if station['type'] == 'Fleet Carrier':
+                self.carriers.append(station)
+            else:
+                self.stations.append(station)
 
 def get_cmdr_api_key(cmdr):
     user = get_user_for_cmdr(cmdr)
@@ -26,29 +96,21 @@ def get_cmdr_api_key(cmdr):
         return get_user_api_key(user)
 
 def get_user_api_key(user):
-    if user in apiKeys:
-        return apiKeys[user]
-        
+    return registry.get_api_key(user)
+
 def get_user_for_cmdr(cmdr):
-    for user, cmd in cmdrNames.items():
-        if cmd == cmdr:
-            return user
-    return None
+    return registry.get_user_for_cmdr(cmdr)
 
 def get_cmdr_for_user(user):
-    if user in cmdrNames:
-        return cmdrNames[user]
-    return None
-    
+    return registry.get_cmdr_for_user(user)
+
 def set_api_key(user, key):
-    apiKeys[user] = key
-    save_data()
-    
+    registry.set_api_key(user, key)
+    dataStore.save_cmdr(registry, user)
+
 def set_cmdr(user, cmdr, key=None):
-    cmdrNames[user] = cmdr
-    if key:
-        apiKeys[user] = key
-    save_data()
+    registry.set_cmdr(user, cmdr, key)
+    dataStore.save_cmdr(registry, user)
 
 def get_cmdr(potential: str):
     potential = potential.strip().strip('@<>')
@@ -69,30 +131,38 @@ def get_cmdr_system_name(cmdr):
         if 'msg' in system: return 'Error: '+system['msg']
         return 'Error: Could not get system for CMDR {0}'.format(cmdr)
 
+async def get_cmdr_system_name_async(cmdr):
+    system = await get_cmdr_system_async(cmdr)
+    if 'system' in system:
+        return system['system']
+    else:
+        if 'msg' in system: return 'Error: '+system['msg']
+        return 'Error: Could not get system for CMDR {0}'.format(cmdr)
+
 def add_POI(name, system):
     coords = get_system_coordinates(system)
+    return _store_POI(name, system, coords)
+
+async def add_POI_async(name, system):
+    coords = await get_system_coordinates_async(system)
+    return _store_POI(name, system, coords)
+
+def _store_POI(name, system, coords):
     if (coords):
         poi = PointOfInterest(name, system, coords)
-        pointsOfInterest[name] = poi
-        save_data()
+        registry.add_POI(poi)
+        dataStore.save_POI(registry, poi)
         return poi
     return None
 
 def remove_POI(name):
-    poi = get_POI(name)
-    if poi:
-        del pointsOfInterest[poi.name]
-        return True
-    return False
-    
+    poi = registry.remove_POI(name)
+    if not poi: return False
+    dataStore.delete_POI(registry, poi.name)
+    return True
+
 def get_POI(name):
-    if (name in pointsOfInterest):
-        return pointsOfInterest[name]
-    nameLower = name.lower()
-    for n, poi in pointsOfInterest.items():
-        if nameLower == n.lower():
-            return poi
-    return None
+    return registry.get_POI(name)
 
 def get_POI_coords(name):
     poi = get_POI(name)
@@ -103,28 +173,77 @@ def get_POI_coords(name):
 def get_POIs():
     return pointsOfInterest
 
+def _plan_resolution(names):
+    '''Answers what it can without EDSM: POIs and anything in the name cache.
+    Returns those resolutions, the registered commanders (name -> cmdr) whose positions are needed and the names left to look up'''
+    resolved = {}
+    cmdrs = {}
+    unknown = []
+    for name in dict.fromkeys(name.strip() for name in names):
+        if not name: continue
+        poi = get_POI(name)
+        if poi:
+            resolved[name] = Resolution(name_resolver.POI, poi.name, poi.coords)
+            continue
+        cmdr, known = get_cmdr(name)
+        cached = nameCache.get(cmdr if known else name)
+        if cached and (cached.kind == name_resolver.CMDR or not known): #a registered commander is always a commander
+            resolved[name] = cached
+        elif known:
+            cmdrs[name] = cmdr
+        else:
+            unknown.append(name)
+    return resolved, cmdrs, unknown
+
+def _add_found_systems(resolved, unknown, found):
+    '''Adds the systems that were found and returns the names that weren't, which might be commanders'''
+    for name, coords in found.items():
+        resolved[name] = nameCache.put(name, Resolution(name_resolver.SYSTEM, name, coords))
+    return {name: name for name in unknown if name not in found}
+
+def _position_resolution(name, cmdr, position, registered):
+    if position is None:
+        return Resolution(None, name) #the lookup failed, don't remember that
+    if isinstance(position, dict) and (registered or 'system' in position):
+        return nameCache.put(cmdr, Resolution(name_resolver.CMDR, cmdr, position.get('coordinates')))
+    return nameCache.put(name, Resolution(None, name))
+
+def resolve_names(names):
+    '''Works out whether each name is a POI, a commander or a system and where it is.
+    Returns a dict of name -> Resolution, with a kind of None for names that matched nothing'''
+    resolved, cmdrs, unknown = _plan_resolution(names)
+    probes = {}
+    if unknown:
+        probes = _add_found_systems(resolved, unknown, get_coordinates_by_name(unknown))
+    for name, cmdr in list(cmdrs.items()) + list(probes.items()):
+        resolved[name] = _position_resolution(name, cmdr, get_cmdr_system(cmdr, True), name in cmdrs)
+    return resolved
+
+async def resolve_names_async(names):
+    '''Like resolve_names, with the systems looked up in one batch and every commander probed at once'''
+    resolved, cmdrs, unknown = _plan_resolution(names)
+    probes = {}
+    if unknown:
+        probes = _add_found_systems(resolved, unknown, await get_coordinates_by_name_async(unknown))
+    lookups = list(cmdrs.items()) + list(probes.items())
+    positions, _ = await gather_lookups(*(get_cmdr_system_async(cmdr, True) for _, cmdr in lookups))
+    for (name, cmdr), position in zip(lookups, positions):
+        resolved[name] = _position_resolution(name, cmdr, position, name in cmdrs)
+    return resolved
+
+def resolve_name(name):
+    return resolve_names([name]).get(name.strip(), Resolution(None, name))
+
+async def resolve_name_async(name):
+    return (await resolve_names_async([name])).get(name.strip(), Resolution(None, name))
+
 def friendly_get_coords(loc):
-    #check if other is POI
-    poi = get_POI_coords(loc)
-    if poi:
-        return poi
+    '''The coordinates of a POI, commander or system, or None if there's no such thing (or it has no known position)'''
+    return resolve_name(loc).coords
+
+async def friendly_get_coords_async(loc):
+    return (await resolve_name_async(loc)).coords
 
-    #check if is a cmdr
-    cmdr, known = get_cmdr(loc)
-    if not known:
-        #Check if it's a system name then
-        system = get_system_coordinates(loc)
-        if system: 
-            return system
-            
-    #try to get distance for cmdr
-    cmdr_system = get_cmdr_system(cmdr, True)
-    if 'coordinates' in cmdr_system:
-        return cmdr_system['coordinates']
-    
-    #No idea what it is, sorry
-    return None
-    
 def friendly_get_distance(a, b):
     coordA = friendly_get_coords(a)
     if coordA:
@@ -133,24 +252,76 @@ def friendly_get_distance(a, b):
             return get_distance(coordA, coordB)
     return -1
 
+async def friendly_get_distance_async(a, b):
+    coordA = await friendly_get_coords_async(a)
+    if coordA:
+        coordB = await friendly_get_coords_async(b)
+        if coordB:
+            return get_distance(coordA, coordB)
+    return -1
+
 def get_system_info_for_display(name):
-    msg = ''
     systemName = name
     poi = get_POI(name) #allow passing a system or a poi
     if poi:
         systemName = poi.system
-        
+
     systemInfo = get_system_info(systemName)
     if not systemInfo:
         return 'Could not find information for system "{0}"'.format(systemName)
-    
+
     bodiesInfo = get_bodies_in_system(systemName)
-    stationInfo = get_stations_in_system(systemName)
-    fleetCarriers = get_fleet_carriers_in_system(systemName)
+    snapshot = get_station_snapshot(systemName)
+    stationInfo = snapshot.stations if snapshot else None
+    fleetCarriers = snapshot.carriers if snapshot else None
     trafficInfo = get_traffic_in_system(systemName)
     deathInfo = get_deaths_in_system(systemName)
     scanInfo = get_system_value(systemName)
-    
+    return format_system_info(systemName, systemInfo, bodiesInfo, stationInfo, fleetCarriers, trafficInfo, deathInfo, scanInfo)
+
+async def get_system_info_for_display_async(name):
+    systemName = name
+    poi = get_POI(name)
+    if poi:
+        systemName = poi.system
+
+    #all of the lookups are independent so fire them at once rather than one after another
+    results, failed = await gather_lookups(
+        get_system_info_async(systemName),
+        get_bodies_in_system_async(systemName),
+        get_station_snapshot_async(systemName),
+        get_traffic_in_system_async(systemName),
+        get_deaths_in_system_async(systemName),
+        get_system_value_async(systemName))
+    systemInfo, bodiesInfo, snapshot, trafficInfo, deathInfo, scanInfo = results
+    if not systemInfo:
+        return 'Could not find information for system "{0}"'.format(systemName)
+    stationInfo = snapshot.stations if snapshot else None
+    fleetCarriers = snapshot.carriers if snapshot else None
+    return format_system_info(systemName, systemInfo, bodiesInfo, stationInfo, fleetCarriers, trafficInfo, deathInfo, scanInfo, failed=failed)
+
+async def gather_lookups(*lookups, timeout=None):
+    '''Runs the lookups concurrently, each EDSM request they make timing out after timeout seconds.
+    The timeout starts once the request is through the rate limiter, queueing behind other requests doesn't count.
+    Returns the results in order (None for any that failed) and the number that failed'''
+    if timeout is None: timeout = subRequestTimeout
+    async def guarded(lookup):
+        try:
+            return await lookup, False
+        except Exception as e:
+            print('EDSM lookup failed: {0!r}'.format(e))
+            return None, True
+    #the lookups' tasks copy the context when gather creates them, so they all see the timeout
+    token = requestTimeout.set(timeout)
+    try:
+        outcomes = await asyncio.gather(*(guarded(lookup) for lookup in lookups))
+    finally:
+        requestTimeout.reset(token)
+    return [result for result, _ in outcomes], sum(1 for _, fail in outcomes if fail)
+
+def format_system_info(systemName, systemInfo, bodiesInfo, stationInfo, fleetCarriers, trafficInfo, deathInfo, scanInfo, failed=0):
+    '''Builds the !ed info message from the individual EDSM lookups, any of which may be None'''
+    msg = ''
     msg += 'Information for {0}:\n'.format(systemName)
     if 'information' in systemInfo and systemInfo['information']: 
         info = systemInfo['information']
@@ -165,7 +336,7 @@ def get_system_info_for_display(name):
         if systemInfo['primaryStar']['isScoopable']: msg += ' (scoopable)'
         msg += '\n'
     
-    if 'bodies' in bodiesInfo and bodiesInfo['bodies']:
+    if bodiesInfo and bodiesInfo['bodies']:
         msg += '{0} known bodies in system.\n'.format(len(bodiesInfo['bodies']))
         
     if stationInfo:
@@ -185,7 +356,7 @@ def get_system_info_for_display(name):
         count = len(fleetCarriers)
         msg += f'{count} fleet carriers in system.\n'
 
-    if 'traffic' in trafficInfo and 'deaths' in deathInfo and trafficInfo['traffic'] and deathInfo['deaths']:
+    if trafficInfo and deathInfo and trafficInfo['traffic'] and deathInfo['deaths']:
         msg += '{0}/{1} CMDRs died in the system in the last 7 days.\n'.format(deathInfo['deaths']['week'], trafficInfo['traffic']['week'])
     
     if 'coords' in systemInfo and systemInfo['coords']: 
@@ -199,6 +370,8 @@ def get_system_info_for_display(name):
             msg += '{0} valuable bodies:\n'.format(len(scanInfo['valuableBodies']))
             for body in scanInfo['valuableBodies']:
                 msg += '{0} ({2}ls): {1:,} credits\n'.format(body['bodyName'], body['valueMax'], body['distance'])
+    if failed:
+        msg += '({0} lookups failed or timed out, information may be incomplete)\n'.format(failed)
     return msg
     
 def extract_system_names_from_flight_log(flightLog):
@@ -209,135 +382,294 @@ def extract_system_names_from_flight_log(flightLog):
         names.append(log['system'])  # newest systems first
     return names
 
+def route_track(names, positions):
+    '''Yields (name, coords) for each system in names, in order, looking coordinates up in
+    the results of get_coordinates_of_systems. coords is None for systems EDSM doesn't know.
+    Consecutive repeats of the same system (relogs, failed jumps) are collapsed'''
+    for _, name, coords in jump_analytics.route_steps(names, positions):
+        yield name, coords
+
+def route_coordinates(names, positions):
+    '''Just the known coordinates along the route, in order'''
+    return [coords for _, coords in route_track(names, positions) if coords]
+
 def get_jump_rate(cmdr, threshold = 7200):
     '''Gets the jump rate for a commander in jumps per hour'''
     logs = get_cmdr_flight_log(cmdr)
-    lastDate = None
-    jumps = 0
-    totalTime = 0
-
-    for log in logs['logs']:
-        if lastDate: 
-            timeDiff = (lastDate - datetime.strptime(log['date'], '%Y-%m-%d %H:%M:%S')).total_seconds()
-            if timeDiff < threshold:
-                jumps += 1
-                totalTime += timeDiff
-        lastDate = datetime.strptime(log['date'], '%Y-%m-%d %H:%M:%S')
-    return jumps/(totalTime/3600.0)
+    return jump_analytics.jump_rate(jump_analytics.from_flight_log(logs), threshold)
+
+async def get_jump_rate_async(cmdr, threshold = 7200):
+    logs = await get_cmdr_flight_log_async(cmdr)
+    return jump_analytics.jump_rate(jump_analytics.from_flight_log(logs), threshold)
 
 def get_average_jump_distance(cmdr):
     '''Gets the average jump distance for the given cmdr'''
     logs = get_cmdr_flight_log(cmdr)
     names = extract_system_names_from_flight_log(logs)
     positions = get_coordinates_of_systems(names)
-    lastPos = None
-    jumps = 0
-    totalDist = 0
-
-    for name in names: #to keep correct order
-        for pos in positions:
-            if pos['name'] == name:
-                if lastPos:
-                    jumps += 1
-                    dist = get_distance(lastPos['coords'], pos['coords'])
-                    totalDist += dist
-                lastPos = pos
-                break
-    if jumps == 0: return 0
-    return totalDist / jumps
+    return jump_analytics.average_distance(jump_analytics.from_flight_log(logs, positions))
+
+async def get_average_jump_distance_async(cmdr):
+    logs = await get_cmdr_flight_log_async(cmdr)
+    names = extract_system_names_from_flight_log(logs)
+    positions = await get_coordinates_of_systems_async(names)
+    return jump_analytics.average_distance(jump_analytics.from_flight_log(logs, positions))
+
+def get_jump_stats(cmdr, threshold = 7200):
+    '''Gets the jump rate, average distance, ly per hour, sessions and percentiles from one flight log fetch'''
+    logs = get_cmdr_flight_log(cmdr)
+    positions = get_coordinates_of_systems(extract_system_names_from_flight_log(logs))
+    return jump_stats(logs, positions, threshold)
+
+async def get_jump_stats_async(cmdr, threshold = 7200):
+    logs = await get_cmdr_flight_log_async(cmdr)
+    positions = await get_coordinates_of_systems_async(extract_system_names_from_flight_log(logs))
+    return jump_stats(logs, positions, threshold)
+
+def jump_stats(logs, positions, threshold = 7200):
+    columns = jump_analytics.from_flight_log(logs, positions)
+    return {
+        'rate': jump_analytics.jump_rate(columns, threshold),
+        'distance': jump_analytics.average_distance(columns),
+        'distancePerHour': jump_analytics.distance_per_hour(columns, threshold),
+        'sessions': jump_analytics.sessions(columns, threshold),
+        'percentiles': jump_analytics.percentiles(columns, threshold=threshold)
+    }
 
 def load_data():
-    apiKeys.clear()
-    cmdrNames.clear()
-    try:
-        with open('data/ed_cmdr.csv', 'r') as f:
-            for line in f:
-                split = line.split(',')
-                if (len(split) < 2 or len(split) > 3):
-                    print('Encountered invalid data "{0}"'.format(line))
-                    continue
-                user = split[0].strip()
-                cmdr = split[1].strip()
-                cmdrNames[user] = cmdr
-                if (len(split) == 3): 
-                    key = split[2].strip()
-                    if key and key != '':
-                        apiKeys[user] = key
-    except FileNotFoundError:
-        print('No data file found, starting with empty data')
+    registry.clear()
+    dataStore.load(registry)
     print('Loaded {0} commanders and {1} api keys'.format(len(cmdrNames), len(apiKeys)))
-    pointsOfInterest.clear()
-    try:
-        with open('data/ed_poi.csv', 'r') as f:
-            for line in f:
-                split = line.split(',')
-                if (len(split) != 5):
-                    print('Encountered invalid data "{0}"'.format(line))
-                    continue
-                name = split[0].strip()
-                system = split[1].strip()
-                x = split[2].strip()
-                y = split[3].strip()
-                z = split[4].strip()
-                coords = {'x': x, 'y': y, 'z': z}
-                poi = PointOfInterest(name, system, coords)
-                pointsOfInterest[name] = poi
-    except FileNotFoundError:
-        print('No points of interest file found, starting with empty data')
     print('Loaded {0} points of interest.'.format(len(pointsOfInterest)))
 
 def save_data():
-    with open('data/ed_cmdr.csv', 'w') as f:
-        for user, cmdr in cmdrNames.items():
-            key = ''
-            if user in apiKeys:
-                key = apiKeys[user]
-            f.write('{0}, {1}, {2}\n'.format(user, cmdr, key))
+    '''Writes everything out at once. Individual changes are saved as they're made'''
+    dataStore.save_all(registry)
     print('Saved {0} commanders and {1} api keys'.format(len(cmdrNames), len(apiKeys)))
-    with open('data/ed_poi.csv', 'w') as f:
-        for _, poi in pointsOfInterest.items():
-            f.write('{0}, {1}, {2}, {3}, {4}\n'
-                .format(poi.name, poi.system, poi.coords['x'], poi.coords['y'], poi.coords['z']))
     print('Saved {0} points of interest'.format(len(pointsOfInterest)))
     
 # Actual API calls to edsm #
-def get_edsm(api, endpoint, params=None):
-    url = 'https://www.edsm.net/api-'
+def edsm_url(api, endpoint):
+    url = edsmUrl
     if api:
         url += '{0}-v1/{1}'.format(api, endpoint)
     else:
         url += 'v1/{0}'.format(endpoint)
-    # if (len(params) > 0):
-    #     url += '?'
-    #     for p, v in params.items():
-    #         if isinstance(v, list):
-    #             fragment = ''
-    #             for val in v:
-    #                 mini = '{0}={1}'.format(p, val)
-    #                 fragment += html.escape(mini) + '&'
-    #             fragment = fragment[:-1]
-    #         else:
-    #             fragment = '{0}={1}'.format(p, v)
-    #             fragment = html.escape(fragment)
-    #         url += fragment + '&'
-    # url = url[:-1]
-    # url = url.replace(' ', '%20')
+    return url
+
+def _retry_delay(attempt, status, headers, url):
+    '''How long to wait before retrying a throttled (429) or failed (5xx) request'''
+    delay = edsm_limiter.backoff_delay(attempt)
+    if status == 429:
+        #throttling is per IP so everyone waits, not just this request
+        delay = max(delay, edsm_limiter.retry_after(headers))
+        edsmLimiter.pause(delay)
+    print('EDSM returned {0} for {1}, retrying in {2:.1f}s'.format(status, url, delay))
+    return delay
+
+def get_edsm(api, endpoint, params=None):
+    cacheKey = edsmCache.make_key(api, endpoint, params)
+    cached = edsmCache.get(cacheKey)
+    if cached is not None: return cached
+    url = edsm_url(api, endpoint)
     if debug: print(url)
-    response_raw = requests.get(url, params=params)
-    if debug: print(response_raw)
-    response = response_raw.json()
+    attempt = 0
+    while True:
+        edsmLimiter.acquire_blocking()
+        requestCounters['network'] += 1
+        try:
+            response_raw = requests.get(url, params=params, timeout=edsmTimeout)
+            if debug: print(response_raw)
+            edsmLimiter.update_from_headers(response_raw.headers)
+            if response_raw.status_code == 429 or response_raw.status_code >= 500:
+                if attempt >= edsmRetries: response_raw.raise_for_status()
+                delay = _retry_delay(attempt, response_raw.status_code, response_raw.headers, url)
+            else:
+                response = response_raw.json()
+                break
+        except requests.ConnectionError as e:
+            if attempt >= edsmRetries: raise
+            delay = edsm_limiter.backoff_delay(attempt)
+            print('Could not reach EDSM ({0!r}), retrying in {1:.1f}s'.format(e, delay))
+        attempt += 1
+        time.sleep(delay)
+    edsmCache.put(cacheKey, response)
+    learn_coordinates(response)
     return response
 
-def get_edsm_with_cmdr(api, endpoint, potential, params=None):
+async def get_session():
+    '''Shared keep-alive session for all async EDSM calls, created on first use'''
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=maxConnections, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=edsmTimeout)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+async def close_session():
+    global _session
+    if _session and not _session.closed:
+        await _session.close()
+    _session = None
+
+def _query_params(params):
+    '''aiohttp wants flat string pairs, so list values (ie systemName[]) are expanded like requests does'''
+    query = []
+    if not params: return query
+    for p, v in params.items():
+        values = v if isinstance(v, list) else [v]
+        query += [(p, str(val)) for val in values]
+    return query
+
+async def get_edsm_async(api, endpoint, params=None):
+    cacheKey = edsmCache.make_key(api, endpoint, params)
+    cached = edsmCache.get(cacheKey)
+    if cached is not None: return cached
+    #identical requests that arrive while one is already running share its response
+    task = _inFlight.get(cacheKey)
+    if task:
+        requestCounters['coalesced'] += 1
+        #the request queues in the lane of whoever started it, don't leave an interactive caller behind the background queue
+        edsmLimiter.promote(task, edsm_limiter.lane.get())
+    else:
+        task = asyncio.ensure_future(_fetch_edsm_async(api, endpoint, params, cacheKey))
+        _inFlight[cacheKey] = task
+        task.add_done_callback(lambda t: _finish_in_flight(cacheKey, t))
+    #shielded so one caller timing out doesn't cancel the request for everyone else
+    return await asyncio.shield(task)
+
+def _finish_in_flight(cacheKey, task):
+    _inFlight.pop(cacheKey, None)
+    if not task.cancelled(): task.exception() #mark as retrieved in case every caller gave up
+
+async def _fetch_edsm_async(api, endpoint, params, cacheKey):
+    url = edsm_url(api, endpoint)
+    if debug: print(url)
+    session = await get_session()
+    attempt = 0
+    timeout = aiohttp.ClientTimeout(total=requestTimeout.get() or edsmTimeout)
+    while True:
+        await edsmLimiter.acquire()
+        requestCounters['network'] += 1
+        try:
+            async with session.get(url, params=_query_params(params), timeout=timeout) as response_raw:
+                if debug: print(response_raw)
+                edsmLimiter.update_from_headers(response_raw.headers)
+                if response_raw.status == 429 or response_raw.status >= 500:
+                    if attempt >= edsmRetries: response_raw.raise_for_status()
+                    delay = _retry_delay(attempt, response_raw.status, response_raw.headers, url)
+                else:
+                    # EDSM doesn't always send a json content type
+                    response = await response_raw.json(content_type=None)
+                    break
+        except aiohttp.ClientConnectionError as e:
+            if attempt >= edsmRetries: raise
+            delay = edsm_limiter.backoff_delay(attempt)
+            print('Could not reach EDSM ({0!r}), retrying in {1:.1f}s'.format(e, delay))
+        attempt += 1
+        await asyncio.sleep(delay)
+    edsmCache.put(cacheKey, response)
+    learn_coordinates(response)
+    return response
+
+def learn_coordinates(response):
+    '''Saves any system coordinates in an EDSM response to the coordinate store'''
+    found = []
+    for item in (response if isinstance(response, list) else [response]):
+        if not isinstance(item, dict): continue
+        if 'name' in item and item.get('coords'):
+            found.append((item['name'], item['coords']))
+        elif 'system' in item and item.get('coordinates'): #logs/get-position
+            found.append((item['system'], item['coordinates']))
+    if found:
+        try:
+            coordStore.put_many(found)
+        except Exception as e:
+            print('Could not store coordinates: {0!r}'.format(e))
+        #a complete index already has every system, and merging more in would copy its memory-mapped arrays into RAM
+        if spatialIndex and not spatialIndex.complete:
+            due = False
+            for name, coords in found:
+                due = spatialIndex.add(name, coords) or due
+            if due: _merge_learned_systems(spatialIndex)
+
+def _merge_learned_systems(index):
+    '''Merges learned systems into the index, in a worker thread when there's an event loop so it doesn't stall commands'''
+    global indexMergeTask
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        index.merge_pending()
+        return
+    if indexMergeTask is None or indexMergeTask.done():
+        indexMergeTask = asyncio.ensure_future(_merge_in_background(index))
+
+async def _merge_in_background(index):
+    try:
+        await asyncio.to_thread(index.merge_pending)
+    except Exception as e:
+        print('Could not merge learned systems into the index: {0!r}'.format(e))
+
+def build_spatial_index():
+    '''Indexes every system in the imported dump (or the coordinate store without one) for local radius and nearest system queries'''
+    global spatialIndex
+    start = time.monotonic()
+    index = SpatialIndex()
+    if dump_import.is_imported(systemDumpDirectory):
+        arrays = dump_import.SystemArrays(systemDumpDirectory)
+        index.add_many(arrays, arrays.xyz)
+        index.complete = True
+    else:
+        names = []
+        chunks = []
+        for batchNames, batchXyz in coordStore.iter_arrays():
+            names.extend(batchNames)
+            chunks.append(batchXyz)
+        if chunks: index.add_many(names, np.concatenate(chunks))
+    spatialIndex = index
+    print('Indexed {0} systems in {1:.1f}s'.format(len(index), time.monotonic() - start))
+    return index
+
+def get_nearest_systems(coords, count=10):
+    '''The closest known systems to coords, from the local index only'''
+    if not spatialIndex: return None
+    return spatialIndex.nearest(coords, count)
+
+async def get_nearest_systems_async(coords, count=10):
+    if not spatialIndex: return None
+    return await asyncio.to_thread(spatialIndex.nearest, coords, count)
+
+def get_cache_stats():
+    stats = edsmCache.stats()
+    stats.update(requestCounters)
+    stats['names'] = nameCache.stats()
+    return stats
+
+def _expect(result, key, description):
+    '''Returns result if it has the given key, otherwise logs why it doesn't and returns None'''
+    if result and key in result:
+        return result
+    print('Could not find {0}'.format(description))
+    if result and 'msg' in result: print(result['msg'])
+    return None
+
+def _cmdr_params(potential, params):
     cmdr, _ = get_cmdr(potential)
     if debug: print('cmdr: '+cmdr)
-    if not cmdr: return 'Could not find commander for user "{0}"'.format(user)
     key = get_cmdr_api_key(cmdr)
-    if not params: params = {}
+    params = dict(params) if params else {}
     params['commanderName'] = cmdr
     if (key): params['apiKey'] = key
-    return get_edsm(api, endpoint, params)
-    
+    return params
+
+def get_edsm_with_cmdr(api, endpoint, potential, params=None):
+    if not potential: return 'Could not find commander for user "{0}"'.format(potential)
+    return get_edsm(api, endpoint, _cmdr_params(potential, params))
+
+async def get_edsm_with_cmdr_async(api, endpoint, potential, params=None):
+    if not potential: return 'Could not find commander for user "{0}"'.format(potential)
+    return await get_edsm_async(api, endpoint, _cmdr_params(potential, params))
+
 def get_cmdr_system(cmdr, getCoords = False):
     api = 'logs'
     endpoint = 'get-position'
@@ -346,6 +678,107 @@ def get_cmdr_system(cmdr, getCoords = False):
     system = get_edsm_with_cmdr(api, endpoint, cmdr, params)
     return system
 
+async def get_cmdr_system_async(cmdr, getCoords = False):
+    if positionPoller and cmdr:
+        #the poller always asks for coordinates so its snapshot serves both kinds of request
+        polled = positionPoller.get(get_cmdr(cmdr)[0])
+        if polled: return polled
+    api = 'logs'
+    endpoint = 'get-position'
+    params = None
+    if getCoords: params = {'showCoordinates': '1' }
+    position = await get_edsm_with_cmdr_async(api, endpoint, cmdr, params)
+    if positionPoller and getCoords and position and 'system' in position:
+        #a live answer is as good as a poll, and tells the poller if an idle commander has started moving
+        positionPoller.record(get_cmdr(cmdr)[0], position)
+    return position
+
+def start_position_poller(minInterval=30, maxInterval=300, maxStaleness=15):
+    '''Starts polling the positions of all registered commanders in the background.
+    Commands use a polled position for up to maxStaleness seconds (the get-position cache TTL), then ask EDSM'''
+    global positionPoller
+    if positionPoller is None:
+        fetch = lambda cmdr: get_edsm_with_cmdr_async('logs', 'get-position', cmdr, {'showCoordinates': '1'})
+        positionPoller = PositionPoller(fetch, lambda: set(cmdrNames.values()), minInterval, maxInterval, maxStaleness)
+    positionPoller.start()
+    return positionPoller
+
+async def stop_position_poller():
+    global positionPoller
+    if positionPoller:
+        await positionPoller.stop()
+    positionPoller = None
+
+def start_data_writer():
+    '''Starts writing registry changes (if dataStore is a WriteBehind) and learned coordinates in the background'''
+    if isinstance(dataStore, storage.WriteBehind):
+        dataStore.start()
+    coordStore.start()
+
+async def stop_data_writer():
+    '''Writes out any registry changes and coordinates that are still queued'''
+    if isinstance(dataStore, storage.WriteBehind):
+        await dataStore.stop()
+    await coordStore.stop()
+
+async def _warm_coordinates(batchSize):
+    '''Resolves every POI's system and every registered commander's position, batchSize names at a time'''
+    names = list(dict.fromkeys([poi.system for poi in pointsOfInterest.values()] + list(cmdrNames.values())))
+    for i in range(0, len(names), batchSize):
+        await resolve_names_async(names[i:i+batchSize])
+        print('Warm-up: resolved {0}/{1} POI systems and commanders'.format(min(i + batchSize, len(names)), len(names)))
+
+async def _warm_indexes(batchSize):
+    if not spatialIndex:
+        await asyncio.to_thread(build_spatial_index)
+
+async def _warm_flight_logs(batchSize):
+    '''Syncs each registered commander's flight log and looks up the coordinates along it, ready for !ed map and !ed rate'''
+    cmdrs = list(dict.fromkeys(cmdrNames.values()))
+    for i, cmdr in enumerate(cmdrs):
+        try:
+            log = await get_cmdr_flight_log_async(cmdr)
+            if log: await get_coordinates_by_name_async(extract_system_names_from_flight_log(log))
+        except Exception as e:
+            print('Warm-up: could not fetch the flight log of {0}: {1!r}'.format(cmdr, e))
+        print('Warm-up: fetched {0}/{1} flight logs'.format(i + 1, len(cmdrs)))
+
+warmUpStages = {
+    'coordinates': _warm_coordinates,
+    'indexes': _warm_indexes,
+    'flightLogs': _warm_flight_logs
+}
+
+async def warm_up(stages=('coordinates', 'indexes', 'flightLogs'), batchSize=10):
+    '''Fills the caches and builds the indexes so the first commands after a restart don't start cold.
+    EDSM requests go in the background lane, so anything users ask for meanwhile goes first'''
+    start = time.monotonic()
+    with edsm_limiter.background():
+        for stage in stages:
+            stageStart = time.monotonic()
+            try:
+                await warmUpStages[stage](batchSize)
+            except Exception as e:
+                print('Warm-up stage {0} failed: {1!r}'.format(stage, e))
+                continue
+            print('Warm-up: {0} done in {1:.1f}s'.format(stage, time.monotonic() - stageStart))
+    print('Warm-up finished in {0:.1f}s'.format(time.monotonic() - start))
+
+def start_warm_up(stages=('coordinates', 'indexes', 'flightLogs')):
+    '''Runs warm_up in the background, once per process'''
+    global warmUpTask
+    if warmUpTask is None and stages:
+        warmUpTask = asyncio.ensure_future(warm_up(stages))
+    return warmUpTask
+
+async def stop_warm_up():
+    if warmUpTask and not warmUpTask.done():
+        warmUpTask.cancel()
+        try:
+            await warmUpTask
+        except asyncio.CancelledError:
+            pass
+
 def get_distance(coord1, coord2):
     dx = float(coord1['x']) - float(coord2['x'])
     dy = float(coord1['y']) - float(coord2['y'])
@@ -354,205 +787,343 @@ def get_distance(coord1, coord2):
     
 def distance_from_cmdr(cmdr, point2):
     cmdrSystem = get_cmdr_system(cmdr, True)
+    return _distance_from_position(cmdr, cmdrSystem, point2)
+
+async def distance_from_cmdr_async(cmdr, point2):
+    cmdrSystem = await get_cmdr_system_async(cmdr, True)
+    return _distance_from_position(cmdr, cmdrSystem, point2)
+
+def _distance_from_position(cmdr, cmdrSystem, point2):
     if not cmdrSystem or not 'coordinates' in cmdrSystem:
         print('Cannot get position for CMDR {0}'.format(cmdr))
         return -1
     cmdrCoord = cmdrSystem['coordinates']
     return get_distance(cmdrCoord, point2)
-    
-def get_system_coordinates(systemName):
-    api = None
-    endpoint = 'system'
-    params = {
+
+def _system_coordinates_params(systemName):
+    return {
         'systemName':systemName,
         'showCoordinates':1
     }
-    system = get_edsm(api, endpoint, params)
-    if 'coords' in system:
-        return system['coords']
-    else:
-        print('Could not find coordinates for system {0}'.format(systemName))
-        if 'msg' in system: print(system['msg'])
-        return None
 
-def get_coordinates_of_systems(systems):
-    '''Returns a list of coordinates for the given list of system names'''
-    api = None
-    endpoint = 'systems'
-    params = {
-        'showCoordinates':1
-    }
-    systemResults = []
-    #do this in groups of 100
+def get_system_coordinates(systemName):
+    coords = coordStore.get(systemName)
+    if coords: return coords
+    system = get_edsm(None, 'system', _system_coordinates_params(systemName))
+    system = _expect(system, 'coords', 'coordinates for system {0}'.format(systemName))
+    return system['coords'] if system else None
+
+async def get_system_coordinates_async(systemName):
+    coords = coordStore.get(systemName)
+    if coords: return coords
+    system = await get_edsm_async(None, 'system', _system_coordinates_params(systemName))
+    system = _expect(system, 'coords', 'coordinates for system {0}'.format(systemName))
+    return system['coords'] if system else None
+
+def _coordinate_chunks(systems):
+    '''Yields the params for each request of up to 100 systems'''
     for i in range(0, len(systems), 100):
         subsystems = systems[i:i+100]
-        if len(subsystems) == 1: params['systemName'] = systems[0]
+        params = {'showCoordinates':1}
+        if len(subsystems) == 1: params['systemName'] = subsystems[0]
         else:
             params['systemName[]'] = subsystems
+        yield params
 
-        results = get_edsm(api, endpoint, params)
-        if len(results) > 0:
-            systemResults += results
-    if len(systemResults) > 0:
-        return systemResults
+def _unresolved_systems(systems):
+    '''Deduplicates the names and splits them into coordinates already in the store and names that still need fetching'''
+    unique = list(dict.fromkeys(systems))
+    resolved = coordStore.get_many(unique)
+    return resolved, [name for name in unique if name not in resolved]
+
+def _add_fetched_coordinates(resolved, missing, results):
+    '''Maps the systems EDSM returned (with its capitalization) back to the requested names'''
+    requested = {name.casefold(): name for name in missing}
+    for system in results or []:
+        name = requested.get(system['name'].casefold())
+        if name and system.get('coords'):
+            resolved[name] = system['coords']
+
+def _coordinates_found(systems, resolved):
+    if len(resolved) > 0:
+        return [{'name': name, 'coords': coords} for name, coords in resolved.items()]
     else:
         print('Could not find coordinates for {0} provided systems'.format(len(systems)))
         return None
-        
-def get_system_info(systemName):
-    api = None
-    endpoint = 'system'
-    params = {
+
+def get_coordinates_by_name(systems):
+    '''Returns a dict of system name to coordinates for each of the given systems that EDSM knows'''
+    resolved, missing = _unresolved_systems(systems)
+    for params in _coordinate_chunks(missing):
+        _add_fetched_coordinates(resolved, missing, get_edsm(None, 'systems', params))
+    return resolved
+
+async def get_coordinates_by_name_async(systems, parallelism=None):
+    '''Like get_coordinates_by_name but sends up to parallelism chunk requests at once.
+    Raises if any chunk fails, like get_coordinates_by_name does, since its systems would otherwise look unknown'''
+    resolved, missing = _unresolved_systems(systems)
+    if not missing: return resolved
+    limit = asyncio.Semaphore(parallelism or coordinateParallelism)
+    async def fetch(params):
+        async with limit:
+            return await get_edsm_async(None, 'systems', params)
+    #no timeout around the chunks, waiting for the semaphore isn't the request taking too long
+    results = await asyncio.gather(*(fetch(params) for params in _coordinate_chunks(missing)), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        #the chunks that did succeed are already in the coordinate store for the next attempt
+        print('{0} of {1} coordinate requests failed'.format(len(errors), len(results)))
+        raise errors[0]
+    for chunk in results:
+        _add_fetched_coordinates(resolved, missing, chunk)
+    return resolved
+
+def get_coordinates_of_systems(systems):
+    '''Returns a list of coordinates for the given list of system names'''
+    return _coordinates_found(systems, get_coordinates_by_name(systems))
+
+async def get_coordinates_of_systems_async(systems):
+    return _coordinates_found(systems, await get_coordinates_by_name_async(systems))
+
+def _system_info_params(systemName):
+    return {
         'systemName':systemName,
         'showCoordinates':1,
         'showPermit':1,
         'showInformation':1,
         'showPrimaryStar':1
     }
-    system = get_edsm(api, endpoint, params)
-    if system and 'name' in system:
-        return system
-    else:
-        print('Could not find system {0}'.format(systemName))
-        if 'msg' in system: print(system['msg'])
-        return None
-        
+
+def get_system_info(systemName):
+    system = get_edsm(None, 'system', _system_info_params(systemName))
+    return _expect(system, 'name', 'system {0}'.format(systemName))
+
+async def get_system_info_async(systemName):
+    system = await get_edsm_async(None, 'system', _system_info_params(systemName))
+    return _expect(system, 'name', 'system {0}'.format(systemName))
+
 def get_system_value(systemName):
     '''Gets the estimated scan value of the system and a list of valuable bodies'''
-    api = 'system'
-    endpoint = 'estimated-value'
-    params = {'systemName': systemName}
-    values = get_edsm(api, endpoint, params)
-    if values:
-        return values
-    else:
-        print('Could not find scan data for system {0}'.format(systemName))
-        return None
+    values = get_edsm('system', 'estimated-value', {'systemName': systemName})
+    return _expect(values, 'estimatedValue', 'scan data for system {0}'.format(systemName))
+
+async def get_system_value_async(systemName):
+    values = await get_edsm_async('system', 'estimated-value', {'systemName': systemName})
+    return _expect(values, 'estimatedValue', 'scan data for system {0}'.format(systemName))
 
 def get_bodies_in_system(systemName):
-    api = 'system'
-    endpoint = 'bodies'
-    params = {'systemName': systemName}
-    bodies = get_edsm(api, endpoint, params)
-    if bodies and 'bodies' in bodies:
-        return bodies
-    else:
-        print('Could not find bodies for system {0}'.format(systemName))
-        if 'msg' in bodies: print(bodies['msg'])
-        return None
-        
+    bodies = get_edsm('system', 'bodies', {'systemName': systemName})
+    return _expect(bodies, 'bodies', 'bodies for system {0}'.format(systemName))
+
+async def get_bodies_in_system_async(systemName):
+    bodies = await get_edsm_async('system', 'bodies', {'systemName': systemName})
+    return _expect(bodies, 'bodies', 'bodies for system {0}'.format(systemName))
+
+def _cached_station_snapshot(systemName):
+    key = systemName.strip().lower()
+    snapshot = stationSnapshots.get(key)
+    if snapshot and time.monotonic() - snapshot.fetched < stationSnapshotTTL:
+        return snapshot
+    stationSnapshots.pop(key, None)
+    return None
+
+def _store_station_snapshot(systemName, stations):
+    stations = _expect(stations, 'stations', 'stations for system {0}'.format(systemName))
+    if not stations: return None
+    snapshot = StationSnapshot(stations['stations'])
+    #drop anything stale so systems that are never looked up again don't pile up
+    for key in [k for k, s in stationSnapshots.items() if snapshot.fetched - s.fetched >= stationSnapshotTTL]:
+        del stationSnapshots[key]
+    stationSnapshots[systemName.strip().lower()] = snapshot
+    return snapshot
+
+def get_station_snapshot(systemName):
+    '''Fetches the station list for a system once, shared by every station query for stationSnapshotTTL seconds'''
+    snapshot = _cached_station_snapshot(systemName)
+    if snapshot: return snapshot
+    stations = get_edsm('system', 'stations', {'systemName': systemName})
+    return _store_station_snapshot(systemName, stations)
+
+async def get_station_snapshot_async(systemName):
+    snapshot = _cached_station_snapshot(systemName)
+    if snapshot: return snapshot
+    stations = await get_edsm_async('system', 'stations', {'systemName': systemName})
+    return _store_station_snapshot(systemName, stations)
+
 def get_stations_in_system(systemName, include_fleet_carriers=False):
-    api = 'system'
-    endpoint = 'stations'
-    params = {'systemName': systemName}
-    stations = get_edsm(api, endpoint, params)
-    if stations and 'stations' in stations:
-        stations_filtered = stations['stations']
-        if not include_fleet_carriers:
-            stations_filtered = [station for station in stations_filtered if station['type'] != 'Fleet Carrier']
-        return stations_filtered
-    else:
-        print('Could not find stations for system {0}'.format(systemName))
-        if 'msg' in stations: print(stations['msg'])
-        return None
+    snapshot = get_station_snapshot(systemName)
+    if not snapshot: return None
+    return snapshot.all if include_fleet_carriers else snapshot.stations
+
+async def get_stations_in_system_async(systemName, include_fleet_carriers=False):
+    snapshot = await get_station_snapshot_async(systemName)
+    if not snapshot: return None
+    return snapshot.all if include_fleet_carriers else snapshot.stations
 
 def get_fleet_carriers_in_system(systemName):
-    api = 'system'
-    endpoint = 'stations'
-    params = {'systemName': systemName}
-    stations = get_edsm(api, endpoint, params)
-    if stations and 'stations' in stations:
-        stations_filtered = stations['stations']
-        stations_filtered = [station for station in stations_filtered if station['type'] == 'Fleet Carrier']
-        return stations_filtered
-    else:
-        print('Could not find fleet carriers for system {0}'.format(systemName))
-        if 'msg' in stations: print(stations['msg'])
-        return None
+    snapshot = get_station_snapshot(systemName)
+    return snapshot.carriers if snapshot else None
+
+async def get_fleet_carriers_in_system_async(systemName):
+    snapshot = await get_station_snapshot_async(systemName)
+    return snapshot.carriers if snapshot else None
 
 def get_traffic_in_system(systemName):
-    api = 'system'
-    endpoint = 'traffic'
-    params = {'systemName': systemName}
-    traffic = get_edsm(api, endpoint, params)
-    if traffic and 'traffic' in traffic:
-        return traffic
-    else:
-        print('Could not find traffic for system {0}'.format(systemName))
-        if 'msg' in traffic: print(traffic['msg'])
-        return None
-        
+    traffic = get_edsm('system', 'traffic', {'systemName': systemName})
+    return _expect(traffic, 'traffic', 'traffic for system {0}'.format(systemName))
+
+async def get_traffic_in_system_async(systemName):
+    traffic = await get_edsm_async('system', 'traffic', {'systemName': systemName})
+    return _expect(traffic, 'traffic', 'traffic for system {0}'.format(systemName))
+
 def get_deaths_in_system(systemName):
-    api = 'system'
-    endpoint = 'deaths'
-    params = {'systemName': systemName}
-    deaths = get_edsm(api, endpoint, params)
-    if deaths and 'deaths' in deaths:
-        return deaths
-    else:
-        print('Could not find deaths for system {0}'.format(systemName))
-        if 'msg' in deaths: print(deaths['msg'])
-        return None
+    deaths = get_edsm('system', 'deaths', {'systemName': systemName})
+    return _expect(deaths, 'deaths', 'deaths for system {0}'.format(systemName))
 
-def get_systems_in_radius(coords, radius, minRadius=0):
-    api = None
-    endpoint = 'sphere-systems'
-    params = {
+async def get_deaths_in_system_async(systemName):
+    deaths = await get_edsm_async('system', 'deaths', {'systemName': systemName})
+    return _expect(deaths, 'deaths', 'deaths for system {0}'.format(systemName))
+
+def _radius_params(coords, radius, minRadius):
+    return {
         'x': coords['x'],
         'y': coords['y'],
         'z': coords['z'],
         'minRadius': minRadius,
-        'radius': radius
+        'radius': radius,
+        'showCoordinates': 1 #so the coordinate store learns every system we see
     }
-    return get_edsm(api, endpoint, params)
+
+def _local_radius_queries():
+    return spatialIndex and (spatialIndex.complete or localRadiusQueries)
+
+def get_systems_in_radius(coords, radius, minRadius=0):
+    if _local_radius_queries():
+        return spatialIndex.sphere(coords, radius, minRadius)
+    return get_edsm(None, 'sphere-systems', _radius_params(coords, radius, minRadius))
+
+async def get_systems_in_radius_async(coords, radius, minRadius=0):
+    if _local_radius_queries():
+        return await asyncio.to_thread(spatialIndex.sphere, coords, radius, minRadius)
+    return await get_edsm_async(None, 'sphere-systems', _radius_params(coords, radius, minRadius))
 
 def get_credits(cmdr):
     '''Get the last recorded credits of a user'''
-    api = 'commander'
-    endpoint = 'get-credits'
-    return get_edsm_with_cmdr(api, endpoint, cmdr)
-	
+    return get_edsm_with_cmdr('commander', 'get-credits', cmdr)
+
+async def get_credits_async(cmdr):
+    return await get_edsm_with_cmdr_async('commander', 'get-credits', cmdr)
+
 def get_ranks(cmdr):
     '''Gets all ranks for a user'''
-    api = 'commander'
-    endpoint = 'get-ranks'
-    return get_edsm_with_cmdr(api, endpoint, cmdr)
+    return get_edsm_with_cmdr('commander', 'get-ranks', cmdr)
+
+async def get_ranks_async(cmdr):
+    return await get_edsm_with_cmdr_async('commander', 'get-ranks', cmdr)
 
 def get_materials(cmdr):
     '''Gets materials for a user'''
-    api = 'commander'
-    endpoint = 'get-materials'
-    return get_edsm_with_cmdr(api, endpoint, cmdr)
+    return get_edsm_with_cmdr('commander', 'get-materials', cmdr)
+
+async def get_materials_async(cmdr):
+    return await get_edsm_with_cmdr_async('commander', 'get-materials', cmdr)
 
 def get_cargo(cmdr):
     '''Gets cargo for a user'''
-    api = 'commander'
-    endpoint = 'get-materials'
-    params = {'type':'cargo'}
-    return get_edsm_with_cmdr(api, endpoint, cmdr, params)
+    return get_edsm_with_cmdr('commander', 'get-materials', cmdr, {'type':'cargo'})
+
+async def get_cargo_async(cmdr):
+    return await get_edsm_with_cmdr_async('commander', 'get-materials', cmdr, {'type':'cargo'})
 
 def get_encoded_data(cmdr):
     '''Gets encoded data for a user'''
-    api = 'commander'
-    endpoint = 'get-materials'
-    params = {'type':'data'}
-    return get_edsm_with_cmdr(api, endpoint, cmdr, params)
+    return get_edsm_with_cmdr('commander', 'get-materials', cmdr, {'type':'data'})
+
+async def get_encoded_data_async(cmdr):
+    return await get_edsm_with_cmdr_async('commander', 'get-materials', cmdr, {'type':'data'})
+
+def _flight_log_params(startDate, endDate):
+    params = {'showId':'0'}
+    if startDate: params['startDateTime'] = startDate
+    if endDate: params['endDateTime'] = endDate
+    return params
+
+logDateFormat = '%Y-%m-%d %H:%M:%S'
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _history_start():
+    return (_utc_now() - timedelta(days=flightLogHistoryDays)).strftime(logDateFormat)
+
+def _flight_log_windows(newest):
+    '''(startDateTime, endDateTime) pairs from the newest cached entry up to now.
+    EDSM returns at most a week of logs per request'''
+    now = _utc_now()
+    start = max(datetime.strptime(newest, logDateFormat), now - timedelta(days=flightLogHistoryDays))
+    while start < now:
+        end = min(start + timedelta(days=7), now)
+        yield start.strftime(logDateFormat), end.strftime(logDateFormat)
+        start = end
+
+def _valid_flight_log(results):
+    return results and isinstance(results, dict) and results.get('msgnum') == 100
+
+def _store_flight_log(cmdr, system, results):
+    '''Caches a full flight log download, merging it into the existing history in incremental mode'''
+    if not _valid_flight_log(results): return results
+    if incrementalFlightLogs:
+        return flightLogCache.extend(cmdr, system, results.get('logs') or [], _history_start())
+    flightLogCache.put(cmdr, system, results)
+    return results
+
+def _sync_flight_log(cmdr, system):
+    newest = flightLogCache.newest_date(cmdr) if incrementalFlightLogs else None
+    if not newest: return None
+    newLogs = []
+    for start, end in _flight_log_windows(newest):
+        delta = get_edsm_with_cmdr('logs', 'get-logs', cmdr, _flight_log_params(start, end))
+        if not _valid_flight_log(delta): return None
+        newLogs += delta.get('logs') or []
+    print('Fetched {0} new flight log entries for user {1}'.format(len(newLogs), cmdr))
+    return flightLogCache.extend(cmdr, system, newLogs, _history_start())
+
+async def _sync_flight_log_async(cmdr, system):
+    newest = flightLogCache.newest_date(cmdr) if incrementalFlightLogs else None
+    if not newest: return None
+    newLogs = []
+    for start, end in _flight_log_windows(newest):
+        delta = await get_edsm_with_cmdr_async('logs', 'get-logs', cmdr, _flight_log_params(start, end))
+        if not _valid_flight_log(delta): return None
+        newLogs += delta.get('logs') or []
+    print('Fetched {0} new flight log entries for user {1}'.format(len(newLogs), cmdr))
+    return flightLogCache.extend(cmdr, system, newLogs, _history_start())
 
 def get_cmdr_flight_log(cmdr, startDate = None, endDate = None):
     '''Gets the flight log for a user'''
     latest = get_cmdr_system(cmdr)
     if not latest or 'system' not in latest: return None
-    key = cmdr+latest['system']
     if not startDate and not endDate:
-        if key in flightLogCache:
+        cached = flightLogCache.get(cmdr, latest['system'])
+        if cached:
             print('Using cached flight data for user {}'.format(cmdr))
-            return flightLogCache[key]
-    api = 'logs'
-    endpoint = 'get-logs'
-    params = {'showId':'0'}
-    if startDate: params['startDateTime'] = startDate
-    if endDate: params['endDateTime'] = endDate
-    results = get_edsm_with_cmdr(api, endpoint, cmdr, params)
+            return cached
+        synced = _sync_flight_log(cmdr, latest['system'])
+        if synced: return synced
+        results = get_edsm_with_cmdr('logs', 'get-logs', cmdr, _flight_log_params(startDate, endDate))
+        return _store_flight_log(cmdr, latest['system'], results)
+    return get_edsm_with_cmdr('logs', 'get-logs', cmdr, _flight_log_params(startDate, endDate))
+
+async def get_cmdr_flight_log_async(cmdr, startDate = None, endDate = None):
+    latest = await get_cmdr_system_async(cmdr)
+    if not latest or 'system' not in latest: return None
     if not startDate and not endDate:
-        flightLogCache[key] = results
-    return results
\ No newline at end of file
+        cached = flightLogCache.get(cmdr, latest['system'])
+        if cached:
+            print('Using cached flight data for user {}'.format(cmdr))
+            return cached
+        synced = await _sync_flight_log_async(cmdr, latest['system'])
+        if synced: return synced
+        results = await get_edsm_with_cmdr_async('logs', 'get-logs', cmdr, _flight_log_params(startDate, endDate))
+        return _store_flight_log(cmdr, latest['system'], results)
+    return await get_edsm_with_cmdr_async('logs', 'get-logs', cmdr, _flight_log_params(startDate, endDate))
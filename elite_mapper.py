@@ -1,161 +1,113 @@
+import asyncio
+import io
+import multiprocessing
 import traceback
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import numpy as np
 
 import elite
+from map_render import MapPlot
+import map_render
+import name_resolver
 
-def normalize_coords(coords):
-    sagA = {'x':25.21875, 'y':-20.90625, 'z':25899.96875}
-    return {'x':(coords['x'] - sagA['x'])/1000, 'y':(coords['y'] - sagA['y'])/1000, 'z':(coords['z'] - sagA['z'])/1000}
+mapWorkers = 2 #processes rendering maps, so the bot stays responsive and maps render in parallel
+maxQueuedMaps = 6 #maps being built or waiting for a worker, any more are turned away until one finishes
+mapDPI = 600 #lower renders and uploads faster
+mapFormat = 'png' #or 'webp', smaller uploads
+galaxyBackdrop = None #optional top down galaxy image (eg 'data/galaxy.png') drawn under full galaxy 2D maps, covering +-45 kly around Sagittarius A*
 
-def plot_systems(a0, a1, a2, includeList=None, label=False):
-    if includeList and len(includeList) == 0: return #empty list, don't plot anything
-    #if list is None, plot all POIs
-    d3 = a0 and not a1
-    xList = []
-    yList = []
-    zList = []
-    nameList = []
-    
-    for name in includeList:
-        coords = elite.friendly_get_coords(name)
-        normalized = normalize_coords(coords)
-        xList.append(normalized['x'])
-        yList.append(normalized['y'])
-        zList.append(normalized['z'])
-        nameList.append(name)
-    
-    if not d3:
-        a0.plot(xList, zList, 'y*', zorder=1)
-        a1.plot(yList, zList, 'y*', zorder=1)
-        a2.plot(xList, yList, 'y*', zorder=1)
-    else:
-        a0.plot(xList, zList, yList, 'y*', zorder=1)
+_pool = None
+_queued = 0
 
-    if label and not d3:
-        for i, name in enumerate(nameList):
-            annotate(a0, name, xList[i], zList[i])
-            annotate(a1, name, yList[i], zList[i])
-            annotate(a2, name, xList[i], yList[i])
+sagA = {'x':25.21875, 'y':-20.90625, 'z':25899.96875}
 
-def plot_route(cmdr, color, a0, a1, a2, label=False):
-    d3 = a0 and not a1
-    xList = []
-    yList = []
-    zList = []
-    names = elite.extract_system_names_from_flight_log(elite.get_cmdr_flight_log(cmdr))
-    infos = elite.get_coordinates_of_systems(names)
-    for name in names:
-        for info in infos:
-            if info['name'] == name:
-                normalized = normalize_coords(info['coords'])
-                xList.append(normalized['x'])
-                yList.append(normalized['y'])
-                zList.append(normalized['z'])
-                break
-    if not d3:
-        a0.plot(xList, zList, 'o-', color=color, markersize=2, zorder=2)
-        a1.plot(yList, zList, 'o-', color=color, markersize=2, zorder=2)
-        a2.plot(xList, yList, 'o-', color=color, markersize=2, zorder=2)
-        if label:
-            annotate(a0, cmdr, xList[0], zList[0])
-            annotate(a1, cmdr, yList[0], zList[0])
-            annotate(a2, cmdr, xList[0], yList[0])
-    else:
-        a0.plot(xList, zList, yList, 'o-', color=color, markersize=2, zorder=2)
+def normalize_coords(coords):
+    return {'x':(coords['x'] - sagA['x'])/1000, 'y':(coords['y'] - sagA['y'])/1000, 'z':(coords['z'] - sagA['z'])/1000}
 
-def limit_and_label(a0, a1, a2, fullGalaxy=True):
-    plot_lim = 45
-    plot_limH = 3
-    if fullGalaxy:
-        a0.set_xlim(-plot_lim, plot_lim)
-        a0.set_ylim(-plot_lim, plot_lim)
-    a0.set_xlabel('X')
-    a0.set_ylabel('Z', rotation=0)
-    if a0 and not a1:
-        #3d
-        if fullGalaxy: a0.set_zlim(-plot_limH, plot_limH)
-        a0.set_zlabel('H')
-    else:
-        if fullGalaxy:
-            a1.set_xlim(plot_limH, -plot_limH)
-            a1.set_ylim(-plot_lim, plot_lim)
-            a2.set_xlim(-plot_lim, plot_lim)
-            a2.set_ylim(-plot_limH, plot_limH)
-        else:
-            a1.invert_xaxis()#set_ylim(a1.get_ylim()[::-1])
-        a1.set_xlabel('H')
-        a1.set_ylabel('Z', rotation=0)
-        a2.set_xlabel('X')
-        a2.set_ylabel('H', rotation=0)
+def normalize_array(xyz):
+    '''normalize_coords for an (n, 3) array of x, y, z'''
+    return (np.asarray(xyz, dtype=np.float64) - (sagA['x'], sagA['y'], sagA['z'])) / 1000
 
-        a0.set_facecolor('k')
-        a1.set_facecolor('k')
-        a2.set_facecolor('k')
-        
-def annotate(ax, txt, pointx, pointy):
-    ax.annotate(txt, (pointx, pointy), xytext=(5, -3), textcoords='offset points', color='w')
+def plot_systems(plot, systems):
+    '''Adds the (name, coords) pairs resolved by parse_items_list'''
+    for name, coords in systems:
+        normalized = normalize_coords({'x': float(coords['x']), 'y': float(coords['y']), 'z': float(coords['z'])})
+        plot.systems.append((name, normalized['x'], normalized['y'], normalized['z']))
 
-def remove_top_right_lines(ax):
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
+async def plot_route(cmdr, color, plot):
+    names = elite.extract_system_names_from_flight_log(await elite.get_cmdr_flight_log_async(cmdr))
+    infos = await elite.get_coordinates_of_systems_async(names)
+    route = elite.route_coordinates(names, infos)
+    xyz = np.array([(c['x'], c['y'], c['z']) for c in route], dtype=np.float64).reshape(-1, 3)
+    plot.routes.append((cmdr, color, normalize_array(xyz)))
 
-def create_plot(items, zoomed=False, threeD=False, labels=False):
-    cmdrs, systems = parse_items_list(items)
-    f, _ = plt.subplots()
-    if threeD:
-        a0 = f.add_subplot(111, projection='3d')
-        a1 = None
-        a2 = None
-    else:
-        f.set_facecolor('k')
-        params = {"ytick.color" : "w",
-            "xtick.color" : "w",
-            "axes.labelcolor" : "w",
-            "axes.edgecolor" : "w"}
-        plt.rcParams.update(params)
-        a0 = plt.subplot2grid((4,4), (0,0), rowspan=3, colspan=3)
-        a1 = plt.subplot2grid((4,4), (0,3), rowspan=3)
-        a2 = plt.subplot2grid((4,4), (3,0), colspan=3)
-        remove_top_right_lines(a0)
-        remove_top_right_lines(a1)
-        remove_top_right_lines(a2)
+def _get_pool():
+    global _pool
+    if _pool is None:
+        #spawned rather than forked, a fork of the bot's threads (sqlite, to_thread workers) could deadlock
+        _pool = ProcessPoolExecutor(mapWorkers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
 
-    limit_and_label(a0, a1, a2, not zoomed)
+async def render(plot):
+    '''Renders the plot in the worker pool and returns the image bytes'''
+    global _pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), map_render.render, plot, mapDPI, mapFormat, galaxyBackdrop)
+    except BrokenProcessPool:
+        _pool = None #a worker died, start a fresh pool next time
+        raise
 
-    plot_systems(a0, a1, a2, systems, labels)
-    for cmdr in cmdrs:
-        plot_route(cmdr, None, a0, a1, a2, labels)
+def shutdown():
+    global _pool
+    if _pool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
 
-    plt.tight_layout()
-    plt.savefig('data/fig.png', facecolor='k', dpi=600)
+async def create_plot(items, zoomed=False, threeD=False, labels=False):
+    '''Builds and renders the map, returning the image in a BytesIO. Returns None without doing anything if too many maps are already queued'''
+    global _queued
+    if _queued >= maxQueuedMaps: return None
+    _queued += 1
+    try:
+        cmdrs, systems = await parse_items_list(items)
+        plot = MapPlot(threeD, zoomed, labels)
+        plot_systems(plot, systems)
+        for cmdr in cmdrs:
+            await plot_route(cmdr, None, plot)
+        image = await render(plot)
+    finally:
+        _queued -= 1
+    return io.BytesIO(image)
 
-def parse_items_list(items):
-    cmdrs = []
-    systems = []
+async def parse_items_list(items):
+    '''Works out what each item is in one pass. Registered commanders are plotted by their route so need no lookup,
+    everything else goes to elite.resolve_names_async together (POIs, then systems in one batch, then commanders all at once).
+    Returns the commanders and (name, coords) for each system, in the order they were given'''
+    kinds = {} #item -> the commander's name, or the coords of a system or POI. None until it's resolved
+    unknown = []
     for item in items:
         item = item.strip()
+        if not item or item in kinds: continue
         cmdr, known = elite.get_cmdr(item)
         if known: #is a known commander
-            cmdrs.append(cmdr)
-        else: #might be a poi, system, or an unknown cmdr
-            poi = elite.get_POI_coords(item)
-            if poi:
-                systems.append(item)
-                continue
-            #not a stored point of interest, maybe a system?
-            system = elite.get_system_coordinates(item)
-            if system:
-                systems.append(item)
-            else: #not a known system, guess it's a commander
-                system = elite.get_cmdr_system(item)
-                if system: cmdrs.append(item)
-                    #unknown, just skip it
+            kinds[item] = cmdr
+            continue
+        kinds[item] = None
+        unknown.append(item)
+    if unknown:
+        for item, resolution in (await elite.resolve_names_async(unknown)).items():
+            if resolution.kind == name_resolver.CMDR:
+                kinds[item] = resolution.name
+            elif resolution.coords:
+                kinds[item] = resolution.coords
+            #unknown, just skip it
+    cmdrs = [kind for kind in kinds.values() if isinstance(kind, str)]
+    systems = [(item, kind) for item, kind in kinds.items() if isinstance(kind, dict)]
     return cmdrs, systems
 
-def parse_and_plot(command): #!ed map magico13, DWStation, Sol, Beagle Point zoomed label 3d
+async def parse_and_plot(command): #!ed map magico13, DWStation, Sol, Beagle Point zoomed label 3d
     split = command.split()
     zoom = False
     label = False
@@ -174,5 +126,4 @@ def parse_and_plot(command): #!ed map magico13, DWStation, Sol, Beagle Point zoo
     #everything else is a system or commander
     items = ' '.join(split)
     split = items.split(',') #these are separated with commas
-    create_plot(split, zoom, d3, label)
-    return True
\ No newline at end of file
+    return await create_plot(split, zoom, d3, label)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def merge_logs(older, newer):
+    '''Combines two lists of flight log entries, dropping duplicates and sorting newest first'''
+    merged = {}
+    for log in older + newer:
+        merged[(log['date'], log['system'])] = log
+    return sorted(merged.values(), key=lambda log: log['date'], reverse=True)
+
+class FlightLogCache:
+    '''Keeps the latest flight log for each commander, bounded by commander count and age.
+    Entries are written through to SQLite so they survive restarts'''
+    def __init__(self, path, maxEntries=500, maxAge=7*24*3600):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge #seconds since the entry was last updated
+        self.entries = OrderedDict() #cmdr -> (updated, system, flightLog), least recently used first
+        self._db = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory: os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS flight_logs (cmdr TEXT PRIMARY KEY, system TEXT, updated REAL, log TEXT)')
+        return self._db
+
+    def _load(self):
+        if self._loaded: return
+        self._loaded = True
+        cutoff = time.time() - self.maxAge
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM flight_logs WHERE updated < ?', (cutoff,))
+            rows = db.execute('SELECT cmdr, system, updated, log FROM flight_logs ORDER BY updated').fetchall()
+        for cmdr, system, updated, log in rows:
+            self.entries[cmdr] = (updated, system, json.loads(log))
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.maxEntries:
+            cmdr, _ = self.entries.popitem(last=False)
+            self._delete(cmdr)
+
+    def _delete(self, cmdr):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM flight_logs WHERE cmdr = ?', (cmdr,))
+
+    def get(self, cmdr, system=None):
+        '''Returns the cached flight log, or None if there isn't one, it's too old,
+        or it was cached while the commander was somewhere other than system'''
+        self._load()
+        entry = self.entries.get(cmdr)
+        if not entry: return None
+        updated, cachedSystem, flightLog = entry
+        if time.time() - updated > self.maxAge:
+            self.remove(cmdr)
+            return None
+        if system is not None and system != cachedSystem: return None
+        self.entries.move_to_end(cmdr)
+        return flightLog
+
+    def put(self, cmdr, system, flightLog):
+        '''Replaces the flight log for the commander'''
+        self._load()
+        updated = time.time()
+        self.entries[cmdr] = (updated, system, flightLog)
+        self.entries.move_to_end(cmdr)
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('INSERT OR REPLACE INTO flight_logs VALUES (?, ?, ?, ?)', (cmdr, system, updated, json.dumps(flightLog)))
+        self._evict()
+
+    def extend(self, cmdr, system, newLogs, oldest=None):
+        '''Merges newer log entries into the cached flight log and returns the result.
+        Entries dated before oldest, if given, are dropped'''
+        self._load()
+        entry = self.entries.get(cmdr)
+        flightLog = dict(entry[2]) if entry else {'msgnum': 100, 'msg': 'OK'}
+        logs = merge_logs(flightLog.get('logs') or [], newLogs or [])
+        if oldest: logs = [log for log in logs if log['date'] >= oldest]
+        flightLog['logs'] = logs
+        self.put(cmdr, system, flightLog)
+        return flightLog
+
+    def newest_date(self, cmdr):
+        '''The date of the most recent cached log entry for the commander, if any'''
+        self._load()
+        entry = self.entries.get(cmdr)
+        if not entry or not entry[2].get('logs'): return None
+        return max(log['date'] for log in entry[2]['logs'])
+
+    def remove(self, cmdr):
+        self._load()
+        if self.entries.pop(cmdr, None):
+            self._delete(cmdr)
+
+    def __len__(self):
+        self._load()
+        return len(self.entries)
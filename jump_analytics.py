@@ -0,0 +1,99 @@
+import numpy as np
+
+class JumpColumns:
+    '''A flight log as columnar arrays, oldest jump first.
+    timestamps are seconds since the epoch and xyz is NaN for systems without known coordinates'''
+    def __init__(self, names, timestamps, xyz):
+        self.names = names
+        self.timestamps = timestamps
+        self.xyz = xyz
+
+    def __len__(self):
+        return len(self.timestamps)
+
+def route_steps(names, positions):
+    '''Yields (i, name, coords) for each system in names, in order, where i is its position in names.
+    Coordinates are looked up in the results of get_coordinates_of_systems, coords is None for systems EDSM doesn't know.
+    Consecutive repeats of the same system (relogs, failed jumps) are collapsed'''
+    index = {}
+    for pos in positions or []:
+        index[pos['name'].casefold()] = pos['coords']
+    lastName = None
+    for i, name in enumerate(names):
+        key = name.casefold()
+        if key == lastName: continue
+        lastName = key
+        yield i, name, index.get(key)
+
+def from_flight_log(flightLog, positions=None):
+    '''Converts an EDSM flight log (and optionally the get_coordinates_of_systems results for it) into columns'''
+    logs = (flightLog or {}).get('logs') or []
+    logs = sorted(logs, key=lambda log: log['date'])
+    steps = list(route_steps([log['system'] for log in logs], positions))
+    kept = np.array([i for i, _, _ in steps], dtype=np.int64)
+    names = np.array([name for _, name, _ in steps], dtype=object)
+    timestamps = np.array([log['date'] for log in logs], dtype='datetime64[s]').astype(np.int64)[kept]
+    xyz = np.full((len(steps), 3), np.nan)
+    for row, (_, _, coords) in enumerate(steps):
+        if coords: xyz[row] = (coords['x'], coords['y'], coords['z'])
+    return JumpColumns(names, timestamps, xyz)
+
+def intervals(columns):
+    '''Seconds between each jump and the one before it'''
+    return np.diff(columns.timestamps)
+
+def distances(columns):
+    '''Distance of each jump, NaN where either end has unknown coordinates'''
+    return np.linalg.norm(np.diff(columns.xyz, axis=0), axis=1)
+
+def jump_rate(columns, threshold=7200):
+    '''Jumps per hour, ignoring gaps of threshold seconds or more between jumps'''
+    gaps = intervals(columns)
+    active = gaps[gaps < threshold]
+    totalTime = active.sum()
+    if totalTime <= 0: return 0.0
+    return len(active) / (totalTime / 3600.0)
+
+def average_distance(columns):
+    '''Average jump distance over the jumps with known coordinates at both ends'''
+    dists = distances(columns)
+    dists = dists[~np.isnan(dists)]
+    if len(dists) == 0: return 0.0
+    return float(dists.mean())
+
+def distance_per_hour(columns, threshold=7200):
+    '''Light years covered per hour of active play'''
+    gaps = intervals(columns)
+    dists = distances(columns)
+    active = (gaps < threshold) & ~np.isnan(dists)
+    totalTime = gaps[active].sum()
+    if totalTime <= 0: return 0.0
+    return float(dists[active].sum() / (totalTime / 3600.0))
+
+def sessions(columns, threshold=7200):
+    '''Splits the log wherever there's a gap of threshold seconds or more.
+    Returns a list of dicts with the start and end timestamps, jump count and distance of each session'''
+    if len(columns) == 0: return []
+    gaps = intervals(columns)
+    dists = np.nan_to_num(distances(columns))
+    breaks = np.flatnonzero(gaps >= threshold) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(columns)])) - 1
+    cumulative = np.concatenate(([0.0], np.cumsum(dists)))
+    return [{
+        'start': int(columns.timestamps[s]),
+        'end': int(columns.timestamps[e]),
+        'jumps': int(e - s),
+        'distance': float(cumulative[e] - cumulative[s])
+    } for s, e in zip(starts, ends)]
+
+def percentiles(columns, q=(50, 90, 99), threshold=7200):
+    '''Percentiles of jump distance and of the time between jumps (excluding breaks)'''
+    dists = distances(columns)
+    dists = dists[~np.isnan(dists)]
+    gaps = intervals(columns)
+    gaps = gaps[gaps < threshold]
+    return {
+        'distance': dict(zip(q, np.percentile(dists, q).tolist())) if len(dists) else {},
+        'interval': dict(zip(q, np.percentile(gaps, q).tolist())) if len(gaps) else {}
+    }
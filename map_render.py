@@ -0,0 +1,272 @@
+import io
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import Collection, LineCollection
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+from matplotlib.patches import Patch
+from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+from PIL import Image
+
+#Renders maps described by a MapPlot. Only uses matplotlib's object oriented API, no pyplot or rcParams,
+#so it's safe to run several renders at once and in worker processes
+
+class MapPlot:
+    '''Everything needed to draw a map, in normalized galactic coordinates. Plain data so it can be sent to a worker process'''
+    def __init__(self, threeD=False, zoomed=False, labels=False):
+        self.threeD = threeD
+        self.zoomed = zoomed
+        self.labels = labels
+        self.systems = [] #(name, x, y, z)
+        self.routes = [] #(cmdr, color, (n, 3) array of x, y, z)
+
+    def bounds(self):
+        '''(low, high) arrays of x, y, z over everything on the map, or None if it's empty'''
+        points = [np.array([s[1:] for s in self.systems]).reshape(-1, 3)] + [xyz for _, _, xyz in self.routes]
+        points = np.concatenate(points)
+        if len(points) == 0: return None
+        return points.min(axis=0), points.max(axis=0)
+
+def draw_systems(plot, a0, a1, a2):
+    if not plot.systems: return
+    nameList = [s[0] for s in plot.systems]
+    xList = [s[1] for s in plot.systems]
+    yList = [s[2] for s in plot.systems]
+    zList = [s[3] for s in plot.systems]
+    if not plot.threeD:
+        a0.plot(xList, zList, 'y*', zorder=1)
+        a1.plot(yList, zList, 'y*', zorder=1)
+        a2.plot(xList, yList, 'y*', zorder=1)
+    else:
+        a0.plot(xList, zList, yList, 'y*', zorder=1)
+
+    if plot.labels and not plot.threeD:
+        for i, name in enumerate(nameList):
+            annotate(a0, name, xList[i], zList[i])
+            annotate(a1, name, yList[i], zList[i])
+            annotate(a2, name, xList[i], yList[i])
+
+routeMarkerSize = 2 #points
+routeLineWidth = 1.5 #points
+
+def _pixel_cells(ax, columns, dpi, cellPixels=1.0):
+    '''Which cellPixels sized cell of the rendered axes each point falls in, as one packed id per point.
+    columns are the point coordinates in the axes' x, y (and z) order'''
+    box = ax.get_position()
+    width, height = ax.figure.get_size_inches() * dpi
+    pixels = max(box.width * width, box.height * height) / cellPixels
+    limits = [ax.get_xlim(), ax.get_ylim()] + ([ax.get_zlim()] if len(columns) == 3 else [])
+    ids = np.zeros(len(columns[0]), dtype=np.int64)
+    for values, (low, high) in zip(columns, limits):
+        low, high = min(low, high), max(low, high)
+        cells = np.floor((values - low) * (pixels / max(high - low, 1e-9))).astype(np.int64)
+        ids = (ids << 21) | (np.clip(cells, -(1 << 20), (1 << 20) - 1) + (1 << 20))
+    return ids
+
+def decimate(points, cells, markerCells):
+    '''Drops what can't be seen at the rendered resolution: points in the same cell as the one before,
+    segments repeating one already drawn between the same two cells, and all but one marker per marker cell.
+    Returns the route as a list of polylines, (n, d) arrays, and the (m, d) marker points left to draw'''
+    _, firstMarkers = np.unique(markerCells, return_index=True)
+    markers = points[np.sort(firstMarkers)]
+    kept = np.concatenate(([0], np.flatnonzero(cells[1:] != cells[:-1]) + 1))
+    points = points[kept]
+    cells = cells[kept]
+    if len(points) < 2: return [], markers
+    start = cells[:-1]
+    end = cells[1:]
+    pairs = np.stack((np.minimum(start, end), np.maximum(start, end)), axis=1)
+    _, first = np.unique(pairs, axis=0, return_index=True)
+    segments = np.sort(first)
+    #join runs of consecutive new segments back into polylines, each polyline is one path to draw
+    breaks = np.flatnonzero(np.diff(segments) != 1) + 1
+    return [points[run[0]:run[-1] + 2] for run in np.split(segments, breaks)], markers
+
+def _draw_decimated(ax, columns, color, dpi):
+    points = np.column_stack(columns)
+    #cells a quarter of the width of the line or marker (and no less than a pixel), any finer detail is hidden under the line itself
+    linePixels = max(1.0, routeLineWidth * dpi / 72 / 4)
+    markerPixels = max(1.0, routeMarkerSize * dpi / 72 / 4)
+    polylines, markers = decimate(points, _pixel_cells(ax, columns, dpi, linePixels), _pixel_cells(ax, columns, dpi, markerPixels))
+    #the markers go first so a color of None takes the next one from the axes' cycle, like a regular plot would
+    line = ax.plot(*markers.T, 'o', color=color, markersize=routeMarkerSize, zorder=2)[0]
+    lines = (Line3DCollection if len(columns) == 3 else LineCollection)(polylines, colors=line.get_color(), linewidths=routeLineWidth, zorder=2)
+    ax.add_collection(lines)
+
+def draw_route(plot, route, a0, a1, a2, dpi=600):
+    '''Draws the route as one line collection per panel, decimated to the rendered resolution
+    so even routes of 100k+ jumps draw in bounded time'''
+    cmdr, color, xyz = route
+    if len(xyz) == 0: return
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    if not plot.threeD:
+        _draw_decimated(a0, (x, z), color, dpi)
+        _draw_decimated(a1, (y, z), color, dpi)
+        _draw_decimated(a2, (x, y), color, dpi)
+        if plot.labels:
+            annotate(a0, cmdr, x[0], z[0])
+            annotate(a1, cmdr, y[0], z[0])
+            annotate(a2, cmdr, x[0], y[0])
+    else:
+        _draw_decimated(a0, (x, z, y), color, dpi)
+
+def zoom_to(plot, a0, a1, a2):
+    '''Sets the limits of a zoomed map to its contents up front, so routes can be decimated to the final scale'''
+    bounds = plot.bounds()
+    if bounds is None: return
+    low, high = bounds
+    pad = np.where(high > low, (high - low) * 0.05, 0.05)
+    (x0, y0, z0), (x1, y1, z1) = low - pad, high + pad
+    a0.set_xlim(x0, x1)
+    a0.set_ylim(z0, z1)
+    if plot.threeD:
+        a0.set_zlim(y0, y1)
+    else:
+        a1.set_xlim(y0, y1)
+        a1.set_ylim(z0, z1)
+        a2.set_xlim(x0, x1)
+        a2.set_ylim(y0, y1)
+
+def limit_and_label(a0, a1, a2, fullGalaxy=True):
+    plot_lim = 45
+    plot_limH = 3
+    if fullGalaxy:
+        a0.set_xlim(-plot_lim, plot_lim)
+        a0.set_ylim(-plot_lim, plot_lim)
+    a0.set_xlabel('X')
+    a0.set_ylabel('Z', rotation=0)
+    if a0 and not a1:
+        #3d
+        if fullGalaxy: a0.set_zlim(-plot_limH, plot_limH)
+        a0.set_zlabel('H')
+    else:
+        if fullGalaxy:
+            a1.set_xlim(plot_limH, -plot_limH)
+            a1.set_ylim(-plot_lim, plot_lim)
+            a2.set_xlim(-plot_lim, plot_lim)
+            a2.set_ylim(-plot_limH, plot_limH)
+        else:
+            a1.invert_xaxis()#set_ylim(a1.get_ylim()[::-1])
+        a1.set_xlabel('H')
+        a1.set_ylabel('Z', rotation=0)
+        a2.set_xlabel('X')
+        a2.set_ylabel('H', rotation=0)
+
+        a0.set_facecolor('k')
+        a1.set_facecolor('k')
+        a2.set_facecolor('k')
+
+def annotate(ax, txt, pointx, pointy):
+    ax.annotate(txt, (pointx, pointy), xytext=(5, -3), textcoords='offset points', color='w')
+
+def remove_top_right_lines(ax):
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+def white_on_black(ax):
+    '''White ticks, labels and axis lines, set on the axes rather than through the global rcParams'''
+    ax.tick_params(colors='w')
+    ax.xaxis.label.set_color('w')
+    ax.yaxis.label.set_color('w')
+    for spine in ax.spines.values():
+        spine.set_edgecolor('w')
+
+def create_axes(fig, threeD):
+    if threeD:
+        return fig.add_subplot(111, projection='3d'), None, None
+    fig.set_facecolor('k')
+    grid = fig.add_gridspec(4, 4)
+    a0 = fig.add_subplot(grid[0:3, 0:3])
+    a1 = fig.add_subplot(grid[0:3, 3])
+    a2 = fig.add_subplot(grid[3, 0:3])
+    for ax in (a0, a1, a2):
+        remove_top_right_lines(ax)
+        white_on_black(ax)
+    return a0, a1, a2
+
+class GalaxyLayer:
+    '''The full galaxy map with nothing on it, ie the axes, limits, styling and an optional backdrop image,
+    drawn once and kept as a raster. Each map restores that raster and draws only its own content on top'''
+    def __init__(self, threeD, dpi, backdrop=None):
+        self.fig = Figure(dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.fig.set_facecolor('k')
+        self.axes = create_axes(self.fig, threeD)
+        limit_and_label(*self.axes, True)
+        if backdrop and not threeD:
+            #a top down image of the galaxy covering the same +-45 kly as the limits, under everything else
+            self.axes[0].imshow(imread(backdrop), extent=(-45, 45, -45, 45), aspect='auto', zorder=0)
+        self.fig.tight_layout()
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self, plot, format='png'):
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        axes = [ax for ax in self.axes if ax]
+        existing = {ax: set(ax.get_children()) for ax in axes}
+        for ax in axes:
+            ax.set_prop_cycle(None) #routes with no color get the same colors as on a fresh figure
+        a0, a1, a2 = self.axes
+        draw_systems(plot, a0, a1, a2)
+        for route in plot.routes:
+            draw_route(plot, route, a0, a1, a2, self.fig.dpi)
+        for ax in axes:
+            added = [artist for artist in ax.get_children() if artist not in existing[ax]]
+            if isinstance(ax, Axes3D): _project_3d(ax, added)
+            for artist in sorted(added, key=lambda artist: artist.get_zorder()):
+                ax.draw_artist(artist)
+            for artist in added:
+                artist.remove() #leave the layer empty for the next map
+        image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format=format)
+        return buffer.getvalue()
+
+def _project_3d(ax, added):
+    '''Does what Axes3D.draw does for collections and patches before drawing them: projects them to 2D
+    and, with computed_zorder, orders them by depth above the axis panes. draw_artist alone skips both,
+    so a Line3DCollection would be drawn from stale (or no) projected segments'''
+    projected = [artist for artist in added if isinstance(artist, (Collection, Patch)) and artist.get_visible()]
+    if not ax.computed_zorder:
+        for artist in projected:
+            artist.do_3d_projection()
+        return
+    zorder = max(axis.get_zorder() for axis in ax._axis_map.values()) + 1
+    collectionZorder = patchZorder = zorder
+    for artist in sorted(projected, key=lambda artist: artist.do_3d_projection(), reverse=True):
+        if isinstance(artist, Collection):
+            artist.zorder = collectionZorder
+            collectionZorder += 1
+        else:
+            artist.zorder = patchZorder
+            patchZorder += 1
+
+_layers = {} #(threeD, dpi, backdrop) -> GalaxyLayer, kept for the life of the (worker) process
+
+def galaxy_layer(threeD, dpi, backdrop=None):
+    key = (threeD, dpi, backdrop)
+    if key not in _layers:
+        _layers[key] = GalaxyLayer(threeD, dpi, backdrop)
+    return _layers[key]
+
+def render(plot, dpi=600, format='png', backdrop=None):
+    '''Draws the map and returns it as image bytes in the given format (png or webp).
+    Full galaxy maps are drawn over a cached GalaxyLayer, zoomed ones need their own axes'''
+    if not plot.zoomed:
+        return galaxy_layer(plot.threeD, dpi, backdrop).render(plot, format)
+    fig = Figure()
+    a0, a1, a2 = create_axes(fig, plot.threeD)
+    if plot.zoomed: zoom_to(plot, a0, a1, a2)
+    limit_and_label(a0, a1, a2, not plot.zoomed)
+
+    draw_systems(plot, a0, a1, a2)
+    for route in plot.routes:
+        draw_route(plot, route, a0, a1, a2, dpi)
+
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=format, facecolor='k', dpi=dpi)
+    return buffer.getvalue()
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+
+#what a name can turn out to be
+POI = 'poi'
+CMDR = 'cmdr'
+SYSTEM = 'system'
+
+class Resolution:
+    '''What a name matched. kind is POI, CMDR, SYSTEM or None if nothing matched,
+    name is the matched POI, commander or system and coords its position (None when it isn't known)'''
+    def __init__(self, kind, name, coords=None):
+        self.kind = kind
+        self.name = name
+        self.coords = coords
+
+    def __repr__(self):
+        return 'Resolution({0!r}, {1!r}, {2!r})'.format(self.kind, self.name, self.coords)
+
+class ResolutionCache:
+    '''LRU cache of what names resolved to, expiring by kind. Commanders move so they're only kept briefly,
+    names that matched nothing are kept for negativeTTL so typos don't go back to EDSM every time'''
+    def __init__(self, systemTTL=3600, cmdrTTL=30, negativeTTL=300, maxEntries=4096):
+        self.ttls = {SYSTEM: systemTTL, CMDR: cmdrTTL, None: negativeTTL}
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(name):
+        return name.strip().casefold()
+
+    def get(self, name):
+        '''Returns the cached Resolution or None if it's missing or expired'''
+        key = self.make_key(name)
+        entry = self.entries.get(key)
+        if entry:
+            expires, resolution = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                if resolution.kind is None: self.negativeHits += 1
+                else: self.hits += 1
+                return resolution
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, name, resolution):
+        '''Caches the resolution for its kind's TTL and returns it'''
+        ttl = self.ttls.get(resolution.kind, 0)
+        if ttl and ttl > 0:
+            key = self.make_key(name)
+            self.entries[key] = (time.monotonic() + ttl, resolution)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return resolution
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'negativeHits': self.negativeHits,
+            'misses': self.misses
+        }
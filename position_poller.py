@@ -0,0 +1,90 @@
+import asyncio
+import random
+import time
+
+import edsm_limiter
+
+class PositionPoller:
+    '''Keeps the latest position of every registered commander in memory by polling in the background.
+    Commanders who are jumping are polled every minInterval seconds, idle ones back off towards maxInterval.
+    Positions are only handed out for maxStaleness seconds after they were fetched, an idle commander may have started moving since'''
+    def __init__(self, fetch, cmdrs, minInterval=30, maxInterval=300, maxStaleness=15):
+        self.fetch = fetch #async function cmdr -> get-position response
+        self.cmdrs = cmdrs #function returning the commanders to poll
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.maxStaleness = maxStaleness
+        self.positions = {} #cmdr -> (fetched, position)
+        self.intervals = {}
+        self.nextPoll = {}
+        self.polls = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get(self, cmdr):
+        '''The last known position of the commander, or None if it hasn't been fetched within maxStaleness'''
+        entry = self.positions.get(cmdr)
+        if entry and time.monotonic() - entry[0] <= self.maxStaleness:
+            return entry[1]
+        return None
+
+    def _schedule(self, cmdr, interval):
+        self.intervals[cmdr] = interval
+        #jitter keeps commanders from all coming due at the same moment
+        self.nextPoll[cmdr] = time.monotonic() + interval * random.uniform(0.9, 1.1)
+
+    async def _poll(self, cmdr):
+        try:
+            position = await self.fetch(cmdr)
+        except Exception as e:
+            print('Could not poll position for CMDR {0}: {1!r}'.format(cmdr, e))
+            self._schedule(cmdr, self.maxInterval)
+            return
+        self.polls += 1
+        if not position or 'system' not in position:
+            self._schedule(cmdr, self.maxInterval)
+            return
+        self.record(cmdr, position, True)
+
+    def record(self, cmdr, position, polled=False):
+        '''Takes a position (with coordinates) fetched for a polled commander, by the poller or a live request.
+        A commander seen in a new system is polled every minInterval again, only the poller's own polls back off'''
+        if not polled and cmdr not in self.nextPoll: return
+        previous = self.positions.get(cmdr)
+        moved = previous and previous[1].get('system') != position['system']
+        self.positions[cmdr] = (time.monotonic(), position)
+        if moved:
+            self._schedule(cmdr, self.minInterval)
+        elif polled:
+            self._schedule(cmdr, min(self.intervals.get(cmdr, self.minInterval) * 2, self.maxInterval))
+
+    async def _run(self):
+        with edsm_limiter.background():
+            while True:
+                now = time.monotonic()
+                cmdrs = set(self.cmdrs())
+                for gone in [cmdr for cmdr in self.nextPoll if cmdr not in cmdrs]:
+                    self.nextPoll.pop(gone, None)
+                    self.intervals.pop(gone, None)
+                    self.positions.pop(gone, None)
+                for cmdr in cmdrs:
+                    if cmdr not in self.nextPoll: #stagger the first poll of each commander
+                        self.nextPoll[cmdr] = now + random.uniform(0, self.minInterval)
+                due = [cmdr for cmdr in cmdrs if self.nextPoll[cmdr] <= now]
+                if due:
+                    await asyncio.gather(*(self._poll(cmdr) for cmdr in due))
+                    continue
+                wait = min(self.nextPoll.values(), default=now + self.minInterval) - now
+                await asyncio.sleep(min(max(wait, 0.1), 5))
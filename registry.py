@@ -0,0 +1,78 @@
+class PointOfInterest:
+    def __init__(self, Name, SystemName, Coords):
+        self.name = Name
+        self.system = SystemName
+        self.coords = Coords
+        self.coords['x'] = float(self.coords['x'])
+        self.coords['y'] = float(self.coords['y'])
+        self.coords['z'] = float(self.coords['z'])
+
+class Registry:
+    '''Registered commanders, their EDSM API keys and the points of interest.
+    Keeps a cmdr -> user index and a case-folded POI name index in step with every change,
+    so lookups in either direction don't scan'''
+    def __init__(self):
+        self.apiKeys = {} #user -> api key
+        self.cmdrNames = {} #user -> cmdr
+        self.pointsOfInterest = {} #name -> PointOfInterest
+        self._usersByCmdr = {} #cmdr -> users registered as it, in registration order
+        self._poiNamesByKey = {} #case-folded name -> POI names, in the order they were added
+
+    def clear(self):
+        self.apiKeys.clear()
+        self.cmdrNames.clear()
+        self.pointsOfInterest.clear()
+        self._usersByCmdr.clear()
+        self._poiNamesByKey.clear()
+
+    def set_cmdr(self, user, cmdr, key=None):
+        previous = self.cmdrNames.get(user)
+        if previous is not None and previous != cmdr:
+            users = self._usersByCmdr.get(previous)
+            if users:
+                users.pop(user, None)
+                if not users: del self._usersByCmdr[previous]
+        self.cmdrNames[user] = cmdr
+        self._usersByCmdr.setdefault(cmdr, {})[user] = None
+        if key:
+            self.apiKeys[user] = key
+
+    def set_api_key(self, user, key):
+        self.apiKeys[user] = key
+
+    def get_api_key(self, user):
+        return self.apiKeys.get(user)
+
+    def get_cmdr_for_user(self, user):
+        return self.cmdrNames.get(user)
+
+    def get_user_for_cmdr(self, cmdr):
+        users = self._usersByCmdr.get(cmdr)
+        if users:
+            return next(iter(users))
+        return None
+
+    def add_POI(self, poi):
+        existing = self.pointsOfInterest.get(poi.name)
+        self.pointsOfInterest[poi.name] = poi
+        if not existing:
+            self._poiNamesByKey.setdefault(poi.name.casefold(), {})[poi.name] = None
+
+    def remove_POI(self, name):
+        '''Removes the POI (matching case insensitively) and returns it, or None if there's no such POI'''
+        poi = self.get_POI(name)
+        if not poi: return None
+        del self.pointsOfInterest[poi.name]
+        key = poi.name.casefold()
+        names = self._poiNamesByKey[key]
+        names.pop(poi.name, None)
+        if not names: del self._poiNamesByKey[key]
+        return poi
+
+    def get_POI(self, name):
+        poi = self.pointsOfInterest.get(name)
+        if poi: return poi
+        names = self._poiNamesByKey.get(name.casefold())
+        if names:
+            return self.pointsOfInterest[next(iter(names))]
+        return None
@@ -0,0 +1,159 @@
+import threading
+
+import numpy as np
+
+_offset = 1 << 20 #keeps cell coordinates positive before they're packed into one id
+
+def _cell_ids(cells):
+    cells = cells.astype(np.int64) + _offset
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+def _shell_offsets(ring):
+    '''Offsets of the cells exactly ring cells away from a cell (in the max norm), the faces of a cube of side 2 * ring + 1'''
+    if ring == 0: return np.zeros((1, 3), dtype=np.int64)
+    full = np.arange(-ring, ring + 1)
+    inner = full[1:-1]
+    faces = []
+    for a, b, c in ((full, full, [-ring, ring]), (full, [-ring, ring], inner), ([-ring, ring], inner, inner)):
+        faces.append(np.stack(np.meshgrid(a, b, c, indexing='ij'), axis=-1).reshape(-1, 3))
+    return np.concatenate(faces)
+
+class SpatialIndex:
+    '''Uniform grid over system coordinates for sphere, shell and nearest system queries.
+    Points live in one array sorted by grid cell, so a query only looks at the cells its sphere covers.
+    Systems added after the last rebuild are kept in a small pending list until merge_pending is called,
+    which can run in a worker thread. Queries can also run in another thread while systems are added or merged,
+    they work on the grid as it was when they started'''
+    def __init__(self, cellSize=50.0, rebuildAt=10000, maxRadius=100, maxNearestRadius=1000):
+        self.cellSize = cellSize
+        self.rebuildAt = rebuildAt
+        self.maxRadius = maxRadius #LY, sphere queries are clamped to this like EDSM's sphere-systems
+        self.maxNearestRadius = maxNearestRadius #LY, nearest gives up beyond this
+        self.baseNames = [] #any sequence, ie the memory-mapped names of an imported dump
+        self.extraNames = [] #systems merged in after the base
+        self.complete = False #set when the base is a full galaxy dump rather than just systems we've seen
+        #(xyz, order, sortedCells), replaced as a whole on a merge so a query in another thread sees a consistent grid
+        self.grid = (np.empty((0, 3), dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.pending = [] #(name, (x, y, z))
+        self._pendingLock = threading.Lock() #systems are added on the event loop while a merge runs in a worker thread
+        self._mergeLock = threading.Lock()
+        self.seen = set() #names added one at a time, so systems we keep seeing aren't added again
+
+    def __len__(self):
+        return len(self.baseNames) + len(self.extraNames) + len(self.pending)
+
+    def _name(self, i):
+        if i < len(self.baseNames): return self.baseNames[i]
+        return self.extraNames[i - len(self.baseNames)]
+
+    def add_many(self, names, xyz):
+        '''Bulk adds systems, xyz being an (n, 3) array. Rebuilds the grid.
+        The first batch is used as is without copying, so it can be memory-mapped'''
+        self.merge_pending()
+        xyz = np.asarray(xyz, dtype=np.float32).reshape(-1, 3)
+        if len(self) == 0:
+            self.baseNames = names
+        else:
+            self.extraNames.extend(names)
+            xyz = np.concatenate((self.grid[0], xyz))
+        self.grid = self._build_grid(xyz)
+
+    def add(self, name, coords):
+        '''Adds a single newly learned system. Returns True once rebuildAt systems are pending and merge_pending is due'''
+        key = name.casefold()
+        if key not in self.seen:
+            self.seen.add(key)
+            with self._pendingLock:
+                self.pending.append((name, (coords['x'], coords['y'], coords['z'])))
+        return len(self.pending) >= self.rebuildAt
+
+    def merge_pending(self):
+        '''Merges the pending systems into the grid and rebuilds it. Systems added meanwhile stay pending'''
+        with self._mergeLock:
+            with self._pendingLock:
+                pending = list(self.pending)
+            if not pending: return
+            grid = self._build_grid(np.concatenate((self.grid[0], np.array([point for _, point in pending], dtype=np.float32))))
+            self.extraNames.extend(name for name, _ in pending)
+            with self._pendingLock: #a query sees the systems either in the grid or still pending, not neither
+                self.grid = grid
+                self.pending = self.pending[len(pending):]
+
+    def _build_grid(self, xyz):
+        cells = _cell_ids(np.floor(xyz / self.cellSize))
+        order = np.argsort(cells, kind='stable')
+        return (xyz, order, cells[order])
+
+    def _snapshot(self):
+        with self._pendingLock:
+            return self.grid, list(self.pending)
+
+    def _candidates(self, grid, cells):
+        '''Indices of the indexed points in the given cells, an (n, 3) array of cell coordinates'''
+        _, order, sortedCells = grid
+        if len(order) == 0 or len(cells) == 0: return np.empty(0, dtype=np.int64)
+        ids = _cell_ids(cells)
+        starts = np.searchsorted(sortedCells, ids, side='left')
+        ends = np.searchsorted(sortedCells, ids, side='right')
+        lengths = ends - starts
+        #expand each cell's [start, end) slice into one flat array of positions
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return order[positions]
+
+    def _cube(self, center, radius):
+        '''Coordinates of every cell touched by the sphere's bounding cube'''
+        low = np.floor((center - radius) / self.cellSize).astype(np.int64)
+        high = np.floor((center + radius) / self.cellSize).astype(np.int64)
+        ranges = [np.arange(low[d], high[d] + 1) for d in range(3)]
+        return np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    def _points(self, grid, candidates, center, pending=()):
+        '''(names, coordinate array, distances) of the candidates and any pending systems'''
+        names = [self._name(i) for i in candidates]
+        xyz = grid[0][candidates]
+        if pending:
+            names += [name for name, _ in pending]
+            xyz = np.concatenate((xyz, np.array([point for _, point in pending], dtype=np.float32)))
+        return names, xyz, np.linalg.norm(xyz - center, axis=1)
+
+    def _results(self, names, xyz, dists, keep, limit=None):
+        order = keep[np.argsort(dists[keep], kind='stable')]
+        results = []
+        seen = set()
+        for i in order:
+            if names[i] in seen: continue #a system both bulk loaded and learned later
+            seen.add(names[i])
+            x, y, z = (float(v) for v in xyz[i])
+            results.append({'name': names[i], 'distance': round(float(dists[i]), 2), 'coords': {'x': x, 'y': y, 'z': z}})
+            if limit and len(results) >= limit: break
+        return results
+
+    def sphere(self, coords, radius, minRadius=0):
+        '''Systems between minRadius and radius LY of coords (radius at most maxRadius), closest first,
+        shaped like EDSM's sphere-systems results'''
+        radius = min(radius, self.maxRadius)
+        center = np.array((coords['x'], coords['y'], coords['z']), dtype=np.float64)
+        grid, pending = self._snapshot()
+        names, xyz, dists = self._points(grid, self._candidates(grid, self._cube(center, radius)), center, pending)
+        return self._results(names, xyz, dists, np.flatnonzero((dists <= radius) & (dists >= minRadius)))
+
+    def nearest(self, coords, k=10, maxRadius=None):
+        '''The k systems closest to coords (within maxRadius LY, at most maxNearestRadius), closest first.
+        Searches outwards one shell of cells at a time, so each cell is only looked at once'''
+        maxRadius = min(maxRadius or self.maxNearestRadius, self.maxNearestRadius)
+        center = np.array((coords['x'], coords['y'], coords['z']), dtype=np.float64)
+        centerCell = np.floor(center / self.cellSize).astype(np.int64)
+        grid, pending = self._snapshot()
+        names, xyz, dists = self._points(grid, np.empty(0, dtype=np.int64), center, pending)
+        ring = 0
+        while True:
+            shellNames, shellXyz, shellDists = self._points(grid, self._candidates(grid, centerCell + _shell_offsets(ring)), center)
+            names += shellNames
+            xyz = np.concatenate((xyz, shellXyz))
+            dists = np.concatenate((dists, shellDists))
+            #every system within ring cells of the center's cell has been seen, so nothing closer than this is missing
+            covered = min(ring * self.cellSize, maxRadius)
+            keep = np.flatnonzero(dists <= covered)
+            if covered >= maxRadius or (len(keep) >= k and len(set(names[i] for i in keep)) >= k):
+                return self._results(names, xyz, dists, keep, k)
+            ring += 1
@@ -0,0 +1,265 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+from registry import PointOfInterest
+
+def _cmdr_row(registry, user):
+    return (registry.cmdrNames[user], registry.apiKeys.get(user))
+
+def _poi_row(poi):
+    return (poi.system, poi.coords['x'], poi.coords['y'], poi.coords['z'])
+
+class Storage:
+    '''Base for the storage backends. Backends implement load, save_all and write_batch,
+    where write_batch takes user -> (cmdr, api key) rows, POI name -> (system, x, y, z) rows and POI names to delete.
+    Single changes are written straight through as a batch of one'''
+    def save_cmdr(self, registry, user):
+        self.write_batch({user: _cmdr_row(registry, user)}, {}, ())
+
+    def save_POI(self, registry, poi):
+        self.write_batch({}, {poi.name: _poi_row(poi)}, ())
+
+    def delete_POI(self, registry, name):
+        self.write_batch({}, {}, (name,))
+
+class CsvStorage(Storage):
+    '''The original ed_cmdr.csv / ed_poi.csv files. Every write rewrites both files from an in-memory copy
+    and swaps them in with a rename, so a crash mid-write never leaves a truncated file behind'''
+    def __init__(self, directory='data'):
+        self.cmdrPath = os.path.join(directory, 'ed_cmdr.csv')
+        self.poiPath = os.path.join(directory, 'ed_poi.csv')
+        self.cmdrs = {} #user -> (cmdr, api key)
+        self.pois = {} #name -> (system, x, y, z)
+
+    def exists(self):
+        return os.path.exists(self.cmdrPath) or os.path.exists(self.poiPath)
+
+    def load(self, registry):
+        try:
+            with open(self.cmdrPath, 'r') as f:
+                for line in f:
+                    split = line.split(',')
+                    if (len(split) < 2 or len(split) > 3):
+                        print('Encountered invalid data "{0}"'.format(line))
+                        continue
+                    user = split[0].strip()
+                    cmdr = split[1].strip()
+                    key = None
+                    if (len(split) == 3):
+                        key = split[2].strip()
+                    registry.set_cmdr(user, cmdr, key)
+        except FileNotFoundError:
+            print('No data file found, starting with empty data')
+        try:
+            with open(self.poiPath, 'r') as f:
+                for line in f:
+                    split = line.split(',')
+                    if (len(split) != 5):
+                        print('Encountered invalid data "{0}"'.format(line))
+                        continue
+                    name = split[0].strip()
+                    system = split[1].strip()
+                    coords = {'x': split[2].strip(), 'y': split[3].strip(), 'z': split[4].strip()}
+                    registry.add_POI(PointOfInterest(name, system, coords))
+        except FileNotFoundError:
+            print('No points of interest file found, starting with empty data')
+        self._copy(registry)
+
+    def _copy(self, registry):
+        self.cmdrs = {user: _cmdr_row(registry, user) for user in registry.cmdrNames}
+        self.pois = {name: _poi_row(poi) for name, poi in registry.pointsOfInterest.items()}
+
+    def _replace(self, path, lines):
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def _write(self):
+        self._replace(self.cmdrPath, ('{0}, {1}, {2}\n'.format(user, cmdr, key or '') for user, (cmdr, key) in self.cmdrs.items()))
+        self._replace(self.poiPath, ('{0}, {1}, {2}, {3}, {4}\n'.format(name, *row) for name, row in self.pois.items()))
+
+    def save_all(self, registry):
+        self._copy(registry)
+        self._write()
+
+    def write_batch(self, cmdrs, pois, removedPOIs):
+        for name in removedPOIs:
+            self.pois.pop(name, None)
+        self.cmdrs.update(cmdrs)
+        self.pois.update(pois)
+        self._write()
+
+class SqliteStorage(Storage):
+    '''Commanders and POIs in SQLite (WAL mode). Each batch of changes is upserted and deleted row by row in one transaction.
+    The first load imports the old CSV files if the database is empty'''
+    def __init__(self, path, csvDirectory='data'):
+        self.path = path
+        self.csv = CsvStorage(csvDirectory)
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory: os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL') #durable enough with WAL, commits don't wait on fsync
+            self._db.execute('CREATE TABLE IF NOT EXISTS cmdrs (user TEXT PRIMARY KEY, cmdr TEXT NOT NULL, apiKey TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS pois (name TEXT PRIMARY KEY, system TEXT NOT NULL, x REAL, y REAL, z REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        return self._db
+
+    def _migrate(self, registry):
+        '''One time copy of the CSV files into the database'''
+        with self._lock:
+            db = self._connect()
+            if db.execute("SELECT 1 FROM meta WHERE key = 'csvMigrated'").fetchone(): return
+            empty = not db.execute('SELECT 1 FROM cmdrs UNION ALL SELECT 1 FROM pois LIMIT 1').fetchone()
+        if empty and self.csv.exists():
+            print('Migrating {0} and {1} to {2}'.format(self.csv.cmdrPath, self.csv.poiPath, self.path))
+            self.csv.load(registry)
+            self.save_all(registry)
+            registry.clear()
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('csvMigrated', '1')")
+
+    def load(self, registry):
+        self._migrate(registry)
+        with self._lock:
+            db = self._connect()
+            cmdrs = db.execute('SELECT user, cmdr, apiKey FROM cmdrs ORDER BY rowid').fetchall()
+            pois = db.execute('SELECT name, system, x, y, z FROM pois ORDER BY rowid').fetchall()
+        for user, cmdr, key in cmdrs:
+            registry.set_cmdr(user, cmdr, key)
+        for name, system, x, y, z in pois:
+            registry.add_POI(PointOfInterest(name, system, {'x': x, 'y': y, 'z': z}))
+
+    def save_all(self, registry):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM cmdrs')
+                db.execute('DELETE FROM pois')
+                db.executemany('INSERT INTO cmdrs VALUES (?, ?, ?)',
+                    [(user,) + _cmdr_row(registry, user) for user in registry.cmdrNames])
+                db.executemany('INSERT INTO pois VALUES (?, ?, ?, ?, ?)',
+                    [(name,) + _poi_row(poi) for name, poi in registry.pointsOfInterest.items()])
+
+    def write_batch(self, cmdrs, pois, removedPOIs):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany('DELETE FROM pois WHERE name = ?', [(name,) for name in removedPOIs])
+                db.executemany('INSERT INTO cmdrs VALUES (?, ?, ?) ON CONFLICT(user) DO UPDATE SET cmdr = excluded.cmdr, apiKey = excluded.apiKey',
+                    [(user,) + row for user, row in cmdrs.items()])
+                db.executemany('INSERT INTO pois VALUES (?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET system = excluded.system, x = excluded.x, y = excluded.y, z = excluded.z',
+                    [(name,) + row for name, row in pois.items()])
+
+class WriteBehind(Storage):
+    '''Queues changes for another backend and writes them in the background, every interval seconds
+    or as soon as batchSize changes are waiting. Repeated changes to the same commander or POI are coalesced.
+    Until start is called (ie outside the bot) changes are written straight through'''
+    def __init__(self, backend, interval=2.0, batchSize=50):
+        self.backend = backend
+        self.interval = interval
+        self.batchSize = batchSize
+        self.flushes = 0
+        self._cmdrs = {}
+        self._pois = {}
+        self._removedPOIs = set()
+        self._lock = threading.Lock() #guards the pending changes
+        self._flushLock = threading.Lock() #keeps batches reaching the backend in order
+        self._task = None
+        self._wake = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cmdrs) + len(self._pois) + len(self._removedPOIs)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        '''Stops the background writer and writes out anything still pending'''
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print('Failed to save data: {0}'.format(e))
+
+    def _queued(self):
+        if self._task is None:
+            self.flush()
+        elif len(self) >= self.batchSize:
+            self._wake.set()
+
+    def save_cmdr(self, registry, user):
+        with self._lock:
+            self._cmdrs[user] = _cmdr_row(registry, user)
+        self._queued()
+
+    def save_POI(self, registry, poi):
+        with self._lock:
+            self._removedPOIs.discard(poi.name)
+            self._pois[poi.name] = _poi_row(poi)
+        self._queued()
+
+    def delete_POI(self, registry, name):
+        with self._lock:
+            self._pois.pop(name, None)
+            self._removedPOIs.add(name)
+        self._queued()
+
+    def flush(self):
+        '''Writes the pending changes to the backend. If that fails they're queued again, behind anything newer'''
+        with self._flushLock:
+            with self._lock:
+                cmdrs, pois, removed = self._cmdrs, self._pois, self._removedPOIs
+                if not (cmdrs or pois or removed): return
+                self._cmdrs, self._pois, self._removedPOIs = {}, {}, set()
+            try:
+                self.backend.write_batch(cmdrs, pois, removed)
+                self.flushes += 1
+            except Exception:
+                with self._lock:
+                    for user, row in cmdrs.items(): self._cmdrs.setdefault(user, row)
+                    for name, row in pois.items():
+                        if name not in self._removedPOIs: self._pois.setdefault(name, row)
+                    for name in removed:
+                        if name not in self._pois: self._removedPOIs.add(name)
+                raise
+
+    def load(self, registry):
+        self.flush()
+        self.backend.load(registry)
+
+    def save_all(self, registry):
+        with self._flushLock:
+            with self._lock:
+                self._cmdrs, self._pois, self._removedPOIs = {}, {}, set()
+            self.backend.save_all(registry)